@@ -1,7 +1,21 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from .query import Database
+def __getattr__(name):
+  # the query module (and SQLAlchemy) is only imported when first needed
+  if name == 'Database':
+    from .query import Database
+    globals()['Database'] = Database
+    return Database
+  if name == 'FileListDatabase':
+    from .filelist import FileListDatabase
+    globals()['FileListDatabase'] = FileListDatabase
+    return FileListDatabase
+  if name == 'RemoteDatabase':
+    from .server import RemoteDatabase
+    globals()['RemoteDatabase'] = RemoteDatabase
+    return RemoteDatabase
+  raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
 
 def get_config():
   """Returns a string containing the configuration information.
@@ -10,4 +24,4 @@ def get_config():
   return bob.extension.get_config(__name__)
 
 # gets sphinx autodoc done right - don't remove it
-__all__ = [_ for _ in dir() if not _.startswith('_')]
+__all__ = ['Database', 'FileListDatabase', 'RemoteDatabase', 'get_config']
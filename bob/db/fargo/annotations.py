@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Consolidated, memory-mapped store of the FARGO annotations
+"""
+
+import os
+import numpy
+
+
+# each annotation is a (y, x) point
+ANNOTATION_KEYS = ('reye', 'leye', 'topleft', 'bottomright')
+
+# the name of the consolidated annotation file
+PACKED_ANNOTATIONS = 'annotations.npy'
+
+
+def to_vector(annotations):
+  """Converts annotations to a vector
+
+  Parameters
+  ----------
+  annotations: dict or None
+    The annotations, as (y, x) points indexed by the keys of
+    :py:data:`ANNOTATION_KEYS`
+
+  Returns
+  -------
+  :py:class:`numpy.ndarray`:
+    The ``2 * len(ANNOTATION_KEYS)`` coordinates, NaN for missing points.
+    Points which are not listed in :py:data:`ANNOTATION_KEYS` are dropped.
+
+  """
+  retval = numpy.full(2 * len(ANNOTATION_KEYS), numpy.nan, dtype=numpy.float32)
+  if annotations:
+    for k, key in enumerate(ANNOTATION_KEYS):
+      if key in annotations:
+        retval[2 * k:2 * k + 2] = annotations[key]
+  return retval
+
+
+def to_dict(vector):
+  """Converts an annotation vector back to a dictionary
+
+  Parameters
+  ----------
+  vector: :py:class:`numpy.ndarray`
+    The coordinates, as returned by :py:func:`to_vector`
+
+  Returns
+  -------
+  dict or None:
+    The available (y, x) points, or None if no point is available
+
+  """
+  retval = {}
+  for k, key in enumerate(ANNOTATION_KEYS):
+    y, x = vector[2 * k], vector[2 * k + 1]
+    if not (numpy.isnan(y) or numpy.isnan(x)):
+      retval[key] = (float(y), float(x))
+  return retval or None
+
+
+def read_annotations(filename, annotation_type):
+  """Reads the annotations of a single file
+
+  Parameters
+  ----------
+  filename: str
+    The annotation file
+  annotation_type: str
+    The type of the file, see :py:func:`bob.db.base.read_annotation_file`
+
+  Returns
+  -------
+  dict or None:
+    The annotations, or None if the file does not exist
+
+  """
+  if not os.path.exists(filename):
+    return None
+  from bob.db.base import read_annotation_file
+  return read_annotation_file(filename, annotation_type)
+
+
+def pack_annotations(files, directory, extension, annotation_type, output):
+  """Consolidates the annotations of many files into a single array
+
+  The array has one row per file id (rows of files without annotations
+  are NaN), and is saved in the ``.npy`` format, so that it can be memory
+  mapped.
+
+  Parameters
+  ----------
+  files: list
+    The files, with ``id`` and ``make_path``
+  directory: str
+    The directory containing the annotation files
+  extension: str
+    The extension of the annotation files
+  annotation_type: str
+    The type of the annotation files
+  output: str
+    The ``.npy`` file to write
+
+  Returns
+  -------
+  int:
+    The number of files with annotations
+
+  """
+  size = max([f.id for f in files]) + 1 if files else 0
+  packed = numpy.lib.format.open_memmap(output, mode='w+', dtype=numpy.float32,
+      shape=(size, 2 * len(ANNOTATION_KEYS)))
+  packed[:] = numpy.nan
+  count = 0
+  for f in files:
+    annotations = read_annotations(f.make_path(directory, extension), annotation_type)
+    if annotations:
+      packed[f.id] = to_vector(annotations)
+      count += 1
+  packed.flush()
+  del packed
+  return count
+
+
+class AnnotationStore(object):
+  """Read-only access to consolidated annotations
+
+  Attributes
+  ----------
+  filename: str
+    The ``.npy`` file created by :py:func:`pack_annotations`
+
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self._packed = numpy.load(filename, mmap_mode='r')
+
+  def __len__(self):
+    return len(self._packed)
+
+  def vectors(self, ids):
+    """Returns the annotations of several files, in one slice
+
+    Parameters
+    ----------
+    ids: :py:class:`numpy.ndarray`
+      The file ids
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      One row of coordinates per file, see :py:func:`to_vector`
+
+    """
+    ids = numpy.asarray(ids, dtype=numpy.int64)
+    retval = numpy.full((len(ids), self._packed.shape[1]), numpy.nan, dtype=numpy.float32)
+    known = ids < len(self._packed)
+    retval[known] = self._packed[ids[known]]
+    return retval
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Measurement helpers for the FARGO database queries
+"""
+
+import sys
+import math
+import time
+import tracemalloc
+
+
+def measure(function, *args, **kwargs):
+  """Runs a function once, measuring its duration and memory
+
+  Parameters
+  ----------
+  function: callable
+    The function to run
+
+  Returns
+  -------
+  tuple:
+    The result, the elapsed time in seconds, and the memory (in bytes)
+    still allocated by the result when the function returns.
+
+  """
+  tracemalloc.start()
+  try:
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+  finally:
+    tracemalloc.stop()
+  return result, elapsed, allocated
+
+
+def compare_result_modes(protocol='uo-rgb2depth', repeats=3, **kwargs):
+  """Compares the ORM and the table results of :py:meth:`bob.db.fargo.Database.objects`
+
+  Each mode is timed on a fresh :py:class:`bob.db.fargo.Database`, so that
+  the results are not shared through the SQLAlchemy identity map. Its
+  session is opened before the measurement, which only covers the query.
+
+  Parameters
+  ----------
+  protocol: str
+    The protocol to query
+  repeats: int
+    The number of times each query is run, the fastest run is reported
+  kwargs:
+    Passed to :py:meth:`bob.db.fargo.Database.objects`
+
+  Returns
+  -------
+  dict:
+    For each mode ('orm' and 'table'), the number of files, the best time
+    in seconds and the memory in bytes held by the result.
+
+  """
+  from .query import Database
+
+  retval = {}
+  for mode, as_table in (('orm', False), ('table', True)):
+    times = []
+    for _ in range(repeats):
+      db = Database()
+      db.protocol_names()
+      result, elapsed, allocated = measure(db.objects, protocol=protocol, as_table=as_table, **kwargs)
+      times.append(elapsed)
+    retval[mode] = {'files': len(result), 'seconds': min(times), 'bytes': allocated}
+  return retval
+
+
+def protocol_queries(db):
+  """Returns the SQL statements run by :py:meth:`bob.db.fargo.Database.objects`
+
+  One statement is generated for the training set and for the enrollment
+  and probe sets of both the dev and eval groups, for every protocol.
+
+  Parameters
+  ----------
+  db: :py:class:`bob.db.fargo.Database`
+    The database used to build the statements
+
+  Returns
+  -------
+  lst:
+    A list of (protocol, group, purpose, sql) tuples
+
+  """
+  from sqlalchemy.dialects import sqlite
+  from .models import File
+
+  retval = []
+  for protocol in db.protocol_names():
+    for group, purpose in (('world', 'train'), ('dev', 'enroll'), ('dev', 'probe'), ('eval', 'enroll'), ('eval', 'probe')):
+      args = db._check_objects_parameters(protocol, purpose, None, group, None)
+      q = db._objects_query((File,), *args)
+      sql = q.statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True})
+      retval.append((protocol, group, purpose, str(sql)))
+  return retval
+
+
+def explain(connection, sql):
+  """Returns the query plan of an SQL statement
+
+  Parameters
+  ----------
+  connection: :py:class:`sqlite3.Connection`
+    The connection to the SQLite database
+  sql: str
+    The statement
+
+  Returns
+  -------
+  lst:
+    The details of each step of the ``EXPLAIN QUERY PLAN`` output
+
+  """
+  return [str(row[-1]) for row in connection.execute('EXPLAIN QUERY PLAN ' + sql)]
+
+
+def profile_queries(sqlite_file, repeats=5):
+  """Records the plan and latency of every protocol query
+
+  The statements are run directly through :py:mod:`sqlite3`, so that
+  different database files (for instance, before and after adding
+  indexes) can be compared.
+
+  Parameters
+  ----------
+  sqlite_file: str
+    The SQLite database file to profile
+  repeats: int
+    The number of times each statement is run, the fastest run is reported
+
+  Returns
+  -------
+  lst:
+    A dictionary per statement with its protocol, group, purpose, number
+    of rows, query plan and best time in seconds.
+
+  """
+  import sqlite3
+  from .query import Database
+
+  # the protocols are those of the profiled file
+  with Database(cache_size=0, sqlite_file=sqlite_file) as db:
+    queries = protocol_queries(db)
+
+  connection = sqlite3.connect(sqlite_file)
+  retval = []
+  try:
+    for protocol, group, purpose, sql in queries:
+      times = []
+      for _ in range(repeats):
+        start = time.perf_counter()
+        rows = connection.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+      retval.append({'protocol': protocol, 'group': group, 'purpose': purpose,
+          'rows': len(rows), 'plan': explain(connection, sql), 'seconds': min(times)})
+  finally:
+    connection.close()
+  return retval
+
+
+def percentile(values, q):
+  """Returns the nearest-rank percentile of a list of values
+
+  Parameters
+  ----------
+  values: list of float
+    The values, which must not be empty
+  q: float
+    The percentile, between 0 and 100
+
+  """
+  values = sorted(values)
+  return values[max(0, int(math.ceil(q / 100. * len(values))) - 1)]
+
+
+def peak_rss():
+  """Returns the peak resident set size of the current process, in bytes"""
+  import resource
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _latencies(times, rows):
+  """Summarizes the times of a query"""
+  p50 = percentile(times, 50)
+  return {'p50': p50, 'p95': percentile(times, 95), 'max': max(times),
+      'rows_per_second': rows / p50 if p50 > 0 else None}
+
+
+def registered_queries(db, protocols=None):
+  """Returns the queries of every protocol purpose registered in the database
+
+  Parameters
+  ----------
+  db: :py:class:`bob.db.fargo.Database`
+    The database
+  protocols: list of str
+    If given, only the queries of these protocols are returned
+
+  Returns
+  -------
+  lst:
+    The (method, keyword arguments) of each query: :py:meth:`objects` for
+    each (protocol, group, purpose), and :py:meth:`clients` and
+    :py:meth:`model_ids` for each (protocol, group)
+
+  """
+  from .models import Protocol, ProtocolPurpose
+
+  q = db.query(Protocol.name, ProtocolPurpose.group, ProtocolPurpose.purpose).\
+      join(ProtocolPurpose, ProtocolPurpose.protocol_id == Protocol.id).order_by(ProtocolPurpose.id)
+  retval = []
+  groups = []
+  for protocol, group, purpose in q:
+    if protocols is not None and protocol not in protocols:
+      continue
+    retval.append(('objects', {'protocol': protocol, 'groups': group, 'purposes': purpose}))
+    if (protocol, group) not in groups:
+      groups.append((protocol, group))
+  for protocol, group in groups:
+    retval.append(('clients', {'protocol': protocol, 'groups': group}))
+    retval.append(('model_ids', {'protocol': protocol, 'groups': group}))
+  return retval
+
+
+def benchmark_queries(repeats=5, protocols=None, **kwargs):
+  """Measures the cold and warm latencies of the database queries
+
+  A cold query is run on a new :py:class:`bob.db.fargo.Database`, and
+  therefore includes opening the database and building its caches. A warm
+  query is run again on the same database, after a first call.
+
+  Parameters
+  ----------
+  repeats: int
+    The number of times each query is run, in each mode
+  protocols: list of str
+    If given, only the queries of these protocols are measured
+  kwargs:
+    Passed to :py:class:`bob.db.fargo.Database`
+
+  Returns
+  -------
+  dict:
+    The measures of each query ('queries'), with its method, arguments,
+    number of rows, and its cold and warm latencies (p50, p95, max in
+    seconds, and rows per second at p50); the total time in seconds
+    ('seconds') and the peak resident set size in bytes ('peak_rss').
+
+  """
+  from .query import Database
+
+  start = time.perf_counter()
+  warm_db = Database(**kwargs)
+  retval = []
+  for method, arguments in registered_queries(warm_db, protocols):
+    cold = []
+    for _ in range(repeats):
+      db = Database(**kwargs)
+      begin = time.perf_counter()
+      result = getattr(db, method)(**arguments)
+      cold.append(time.perf_counter() - begin)
+
+    getattr(warm_db, method)(**arguments)
+    warm = []
+    for _ in range(repeats):
+      begin = time.perf_counter()
+      result = getattr(warm_db, method)(**arguments)
+      warm.append(time.perf_counter() - begin)
+
+    entry = {'method': method, 'rows': len(result)}
+    entry.update(arguments)
+    entry['cold'] = _latencies(cold, len(result))
+    entry['warm'] = _latencies(warm, len(result))
+    retval.append(entry)
+
+  return {'queries': retval, 'seconds': time.perf_counter() - start, 'peak_rss': peak_rss()}
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Bounded cache of query results
+"""
+
+import os
+import threading
+import collections
+
+
+def file_stamp(filename):
+  """Returns the modification time and size of a file
+
+  Parameters
+  ----------
+  filename: str
+    The file to check
+
+  Returns
+  -------
+  tuple or None:
+    The (mtime, size) of the file, or None if the file does not exist.
+
+  """
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  return (st.st_mtime, st.st_size)
+
+
+class QueryCache(object):
+  """Least-recently-used cache of query results
+
+  All entries are tied to the modification time and size of a file:
+  as soon as they change, the whole cache is cleared. The cache may be
+  shared between threads.
+
+  Attributes
+  ----------
+  capacity: int
+    The maximum number of entries
+  hits: int
+    The number of lookups that found an entry
+  misses: int
+    The number of lookups that did not find an entry
+  evictions: int
+    The number of entries removed to make room for new ones
+
+  """
+
+  def __init__(self, capacity, filename):
+    """ Init function
+
+    Parameters
+    ----------
+    capacity: int
+      The maximum number of entries
+    filename: str
+      The file the entries depend on
+
+    """
+    self.capacity = capacity
+    self.filename = filename
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = collections.OrderedDict()
+    self._stamp = file_stamp(filename)
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['_lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+  def copy(self, keep):
+    """Returns a copy of the cache, with some of its entries
+
+    The counters are copied as well.
+
+    Parameters
+    ----------
+    keep: callable
+      Called with the key and value of each entry, returns True if the
+      entry should be kept
+
+    Returns
+    -------
+    :py:class:`QueryCache`:
+      The new cache
+
+    """
+    with self._lock:
+      retval = QueryCache.__new__(QueryCache)
+      retval.__setstate__(self.__getstate__())
+      retval._entries = collections.OrderedDict((k, v) for k, v in self._entries.items() if keep(k, v))
+    return retval
+
+  def validate(self):
+    """Clears the cache if the file changed
+
+    Returns
+    -------
+    bool:
+      True if the file changed since the last call
+
+    """
+    stamp = file_stamp(self.filename)
+    with self._lock:
+      if stamp == self._stamp:
+        return False
+      self._stamp = stamp
+      self._entries.clear()
+    return True
+
+  def get(self, key):
+    """Looks up an entry
+
+    Parameters
+    ----------
+    key: hashable
+      The key of the entry
+
+    Returns
+    -------
+    tuple:
+      A boolean telling if the entry was found, and its value (or None)
+
+    """
+    with self._lock:
+      try:
+        value = self._entries.pop(key)
+      except KeyError:
+        self.misses += 1
+        return False, None
+      self._entries[key] = value
+      self.hits += 1
+    return True, value
+
+  def put(self, key, value):
+    """Adds an entry, evicting the least recently used one if needed
+
+    Parameters
+    ----------
+    key: hashable
+      The key of the entry
+    value: object
+      The value of the entry
+
+    """
+    with self._lock:
+      self._entries.pop(key, None)
+      while self._entries and len(self._entries) >= self.capacity:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+      if self.capacity > 0:
+        self._entries[key] = value
+
+  def clear(self):
+    """Removes all entries, keeping the counters"""
+    with self._lock:
+      self._entries.clear()
+
+  def info(self):
+    """Returns the counters of the cache
+
+    Returns
+    -------
+    dict:
+      The hits, misses, evictions, current size and capacity
+
+    """
+    with self._lock:
+      return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+          'size': len(self._entries), 'capacity': self.capacity}
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Concurrent checks of the FARGO files on disk
+
+Files are grouped by their parent directory, and each directory is listed
+once, instead of checking the existence of every file separately. This
+keeps the number of round trips low on network file systems.
+
+The content of the files can also be verified: each file is hashed, and
+PNG files are checked for truncation. The hashes are kept in a manifest,
+with the size and modification time of each file, so that only modified
+files are read again.
+"""
+
+import os
+import csv
+import json
+import hashlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the attributes grouping the missing files in the reports
+REPORT_KEYS = ('client_id', 'light', 'device', 'recording')
+
+# the name of the checksum manifest, stored next to the images
+CHECKSUM_MANIFEST = 'checksums.json'
+
+# the last chunk of every complete PNG file: an empty IEND chunk with its CRC
+PNG_TRAILER = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+
+def _list_directory(directory):
+  """Returns the names of the entries of a directory, empty if it does not exist"""
+  try:
+    with os.scandir(directory) as entries:
+      return set(entry.name for entry in entries)
+  except (FileNotFoundError, NotADirectoryError):
+    return set()
+
+
+def find_missing(files, directory=None, extension=None, workers=8):
+  """Returns the files which cannot be found on disk
+
+  Parameters
+  ----------
+  files: list
+    The files, with ``make_path``
+  directory: str
+    The directory containing the files
+  extension: str
+    The extension of the files
+  workers: int
+    The number of directories listed at once
+
+  Returns
+  -------
+  list:
+    The missing files, in the order of ``files``
+
+  """
+  by_directory = collections.OrderedDict()
+  for f in files:
+    parent, name = os.path.split(f.make_path(directory, extension))
+    by_directory.setdefault(parent, []).append((name, f))
+
+  with ThreadPoolExecutor(max(1, workers)) as pool:
+    listings = dict(zip(by_directory, pool.map(_list_directory, by_directory)))
+
+  missing = []
+  for parent, entries in by_directory.items():
+    missing.extend(f for name, f in entries if name not in listings[parent])
+  return sorted(missing, key=lambda f: f.id)
+
+
+def _hash_file(filename, block_size=1 << 20):
+  """Returns the SHA-256 digest of a file, and whether it is complete
+
+  Only PNG files can be incomplete: they must end with the IEND chunk.
+
+  """
+  sha = hashlib.sha256()
+  last = b''
+  with open(filename, 'rb') as f:
+    while True:
+      block = f.read(block_size)
+      if not block:
+        break
+      sha.update(block)
+      last = (last + block)[-len(PNG_TRAILER):]
+  complete = not filename.lower().endswith('.png') or last == PNG_TRAILER
+  return sha.hexdigest(), complete
+
+
+def read_manifest(filename):
+  """Reads a checksum manifest, empty if it does not exist
+
+  Returns
+  -------
+  dict:
+    The (size, mtime in ns, sha256, complete) of each relative path
+
+  """
+  if not os.path.exists(filename):
+    return {}
+  with open(filename) as f:
+    return dict((path, tuple(entry)) for path, entry in json.load(f).items())
+
+
+def write_manifest(filename, manifest):
+  """Writes a checksum manifest, replacing the previous one at once"""
+  temporary = filename + '.tmp'
+  with open(temporary, 'w') as f:
+    json.dump(dict((path, list(entry)) for path, entry in manifest.items()), f, sort_keys=True)
+  os.replace(temporary, filename)
+
+
+def verify_files(files, directory=None, extension=None, manifest=None, workers=8, rehash=False):
+  """Verifies the content of existing files
+
+  Files are hashed in a thread pool, unless their size and modification
+  time are those recorded in the manifest.
+
+  Parameters
+  ----------
+  files: list
+    The files, with ``path`` and ``make_path``, which must exist
+  directory: str
+    The directory containing the files
+  extension: str
+    The extension of the files
+  manifest: dict
+    The previous checksum manifest, see :py:func:`read_manifest`
+  workers: int
+    The number of files hashed at once
+  rehash: bool
+    If set, all files are hashed, and files whose size and modification
+    time did not change must also have the same hash
+
+  Returns
+  -------
+  tuple:
+    The updated manifest, the corrupted files (incomplete, or modified
+    without changing their size and modification time), and the number
+    of hashed files
+
+  """
+  manifest = dict(manifest or {})
+
+  def _verify(f):
+    filename = f.make_path(directory, extension)
+    key = f.path + (extension or '')
+    stat = os.stat(filename)
+    previous = manifest.get(key)
+    unchanged = previous is not None and tuple(previous[:2]) == (stat.st_size, stat.st_mtime_ns)
+    if unchanged and not rehash:
+      return key, previous, previous[3], False
+    digest, complete = _hash_file(filename)
+    valid = complete and (not unchanged or digest == previous[2])
+    return key, (stat.st_size, stat.st_mtime_ns, digest, complete), valid, True
+
+  corrupted = []
+  hashed = 0
+  with ThreadPoolExecutor(max(1, workers)) as pool:
+    for f, (key, entry, valid, read) in zip(files, pool.map(_verify, files)):
+      manifest[key] = entry
+      hashed += read
+      if not valid:
+        corrupted.append(f)
+  return manifest, corrupted, hashed
+
+
+def group_missing(missing):
+  """Groups missing (or corrupted) files by client, light (session), device and recording
+
+  Parameters
+  ----------
+  missing: list
+    The missing files, as returned by :py:func:`find_missing`, or the
+    corrupted files, as returned by :py:func:`verify_files`
+
+  Returns
+  -------
+  :py:class:`collections.OrderedDict`:
+    The missing files of each (client_id, light, device, recording)
+
+  """
+  retval = collections.OrderedDict()
+  for f in sorted(missing, key=lambda f: tuple(getattr(f, k) for k in REPORT_KEYS) + (f.id,)):
+    retval.setdefault(tuple(getattr(f, k) for k in REPORT_KEYS), []).append(f)
+  return retval
+
+
+def write_report(output, missing, total, directory=None, extension=None, format='json', corrupted=()):
+  """Writes a machine-readable report of the missing and corrupted files
+
+  Parameters
+  ----------
+  output: file
+    The opened file to write into
+  missing: list
+    The missing files, as returned by :py:func:`find_missing`
+  total: int
+    The number of checked files
+  directory, extension: str
+    The directory and extension of the files
+  format: str
+    Either 'json', with one entry per group of :py:data:`REPORT_KEYS`, or
+    'csv', with one line per missing or corrupted file
+  corrupted: list
+    The corrupted files, as returned by :py:func:`verify_files`
+
+  """
+  status = collections.OrderedDict([('missing', missing), ('corrupted', corrupted)])
+  groups = collections.OrderedDict()
+  for name, files in status.items():
+    for key, group in group_missing(files).items():
+      groups.setdefault(key, dict((k, []) for k in status))[name] = [f.make_path(directory, extension) for f in group]
+  groups = collections.OrderedDict(sorted(groups.items()))
+
+  if format == 'json':
+    json.dump({
+      'directory': directory,
+      'extension': extension,
+      'files': total,
+      'missing': len(missing),
+      'corrupted': len(corrupted),
+      'groups': [dict(list(zip(REPORT_KEYS, key)) + list(paths.items())) for key, paths in groups.items()],
+    }, output, indent=1)
+    output.write('\n')
+  elif format == 'csv':
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(REPORT_KEYS + ('status', 'path'))
+    for key, paths in groups.items():
+      for name in status:
+        for path in paths[name]:
+          writer.writerow(key + (name, path))
+  else:
+    raise ValueError("Unknown report format '%s', valid formats are ('json', 'csv')" % format)
@@ -10,47 +10,212 @@ import bob.core
 logger = bob.core.log.setup('bob.db.fargo')
 
 
-def add_clients(session, imagesdir):
-  """Add clients
+# the modality recorded by each stream
+STREAM_MODALITIES = {'color': 'rgb', 'ir': 'nir', 'depth': 'depth'}
 
-  This function adds clients to the database. 
+# the number of rows given at once to bulk insertions
+BULK_SIZE = 10000
+
+# the columns of the file information, see parse_path
+FILE_COLUMNS = ('client_id', 'path', 'light', 'device', 'recording', 'modality', 'pose')
+
+# the suffix of the manifest of the client directories, see create --update
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def client_group(client_id):
+  """Returns the group of a client, given its id"""
+  if client_id <= 25:
+    return 'world'
+  elif client_id <= 50:
+    return 'dev'
+  return 'eval'
+
+
+def parse_path(image_info, extension='.png'):
+  """Returns the information of a face image, based on its path
+
+  Parameters
+  ----------
+  image_info : :py:obj:str
+    The path of the image, relative to the images directory, with ``/``
+    separators
+  extension: :py:obj:str
+    The extension of the image file.
+
+  Returns
+  -------
+  tuple:
+    The (client_id, path, light, device, recording, modality, pose) of the
+    file, where path is the relative path without extension
+
+  """
+  infos = image_info.split('/')
+
+  client_id = int(infos[0])
+  light = infos[1]
+  device = infos[2].replace('SR300-', '')
+  recording = infos[3]
+  modality = STREAM_MODALITIES[infos[4]]
+
+  # default pose is frontal
+  pose = 'frontal'
+  if 'yaw' in image_info:
+    pose = 'yaw'
+  if 'pitch' in image_info:
+    pose = 'pitch'
+
+  return (client_id, image_info[0:-len(extension)], light, device, recording, modality, pose)
+
+
+def _scan_directory(imagesdir, client, extension, parse=True):
+  """Lists the face images of a client directory, with :py:func:`os.scandir`
+
+  Returns
+  -------
+  tuple:
+    The information of each image (see :py:func:`parse_path`), sorted by
+    path, or None if ``parse`` is not set, and the state of the directory
+    (see :py:func:`client_states`)
+
+  """
+  retval = []
+  count = 0
+  mtime = os.stat(os.path.join(imagesdir, client)).st_mtime
+  directories = [client]
+  while directories:
+    directory = directories.pop()
+    for entry in os.scandir(os.path.join(imagesdir, directory)):
+      image_info = directory + '/' + entry.name
+      if entry.is_dir():
+        directories.append(image_info)
+        mtime = max(mtime, entry.stat().st_mtime)
+      elif os.path.splitext(entry.name)[1] == extension:
+        count += 1
+        if parse:
+          retval.append(parse_path(image_info, extension))
+  if not parse:
+    return None, (mtime, count)
+  retval.sort(key=lambda f: f[1])
+  return retval, (mtime, count)
+
+
+def _client_directories(imagesdir):
+  """Returns the sorted client directories, named after the client ids
+
+  Other entries, such as ``checksums.json`` or ``.DS_Store``, are ignored.
+
+  """
+  return sorted(d for d in os.listdir(imagesdir) if d.isdigit() and os.path.isdir(os.path.join(imagesdir, d)))
+
+
+def scan_files(imagesdir, extension='.png', workers=8, clients=None, states=None):
+  """Scans the face images, client directories being listed in parallel
 
   Parameters
   ----------
-  session:
-    The session to the SQLite database 
   imagesdir : :py:obj:str
     The directory where the images have been extracted
-  verbose : bool
-    Print some information
+  extension: :py:obj:str
+    The extension of the image files.
+  workers: int
+    The number of directories scanned at once
+  clients: list of :py:obj:str
+    The client directories to scan, all by default
+  states: dict
+    If given, it is filled with the state of each scanned client
+    directory, see :py:func:`client_states`
+
+  Yields
+  ------
+  tuple:
+    The information of each image, see :py:func:`parse_path`, ordered by
+    client directory and path
 
   """
-  for d in os.listdir(imagesdir):
-    client_id = int(d)
-    if client_id <= 25:
-      group = 'world'
-    elif client_id <= 50:
-      group = 'dev'
-    else:
-      group = 'eval'
-    logger.info("Adding client {} in group {}".format(client_id, group))
-    session.add(Client(client_id, group))
+  from concurrent.futures import ThreadPoolExecutor
 
-def add_files(session, imagesdir, extension='.png'):
-  """ Add face images files.
+  if clients is None:
+    clients = _client_directories(imagesdir)
+  with ThreadPoolExecutor(max(1, workers)) as pool:
+    for client, (files, state) in zip(clients, pool.map(lambda c: _scan_directory(imagesdir, c, extension), clients)):
+      if states is not None:
+        states[client] = state
+      for f in files:
+        yield f
 
-  This function adds the face image files to the database.
+
+def client_states(imagesdir, extension='.png', workers=8):
+  """Returns the state of each client directory, without parsing the images
 
   Parameters
   ----------
-  session:
-    The session to the SQLite database 
   imagesdir : :py:obj:str
     The directory where the images have been extracted
   extension: :py:obj:str
-    The extension of the image file.
+    The extension of the image files.
+  workers: int
+    The number of directories scanned at once
+
+  Returns
+  -------
+  dict:
+    For each client directory, the latest modification time of its
+    (sub-)directories and its number of images
+
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  clients = _client_directories(imagesdir)
+  with ThreadPoolExecutor(max(1, workers)) as pool:
+    return dict((c, state) for c, (_, state) in zip(clients,
+        pool.map(lambda c: _scan_directory(imagesdir, c, extension, parse=False), clients)))
+
+
+def manifest_file(dbfile):
+  """Returns the manifest of the client directories, stored next to the database"""
+  return dbfile + MANIFEST_SUFFIX
+
+
+def read_manifest(filename):
+  """Reads the client directory states, as written by :py:func:`write_manifest`"""
+  import json
+  with open(filename) as f:
+    return dict((c, tuple(state)) for c, state in json.load(f)['clients'].items())
+
+
+def write_manifest(filename, states):
+  """Writes the client directory states, see :py:func:`client_states`"""
+  import json
+  with open(filename, 'w') as f:
+    json.dump({'clients': dict((c, list(state)) for c, state in states.items())}, f, indent=1, sort_keys=True)
+
+
+def former_add_clients(session, imagesdir):
+  """Adds the clients one by one, as done formerly
+
+  This is only kept to compare the ingestion times, see :py:func:`compare_ingestions`
 
   """
+  for d in _client_directories(imagesdir):
+    client_id = int(d)
+    group = client_group(client_id)
+    logger.info("Adding client {} in group {}".format(client_id, group))
+    session.add(Client(client_id, group))
+
+
+def former_add_files(session, imagesdir, extension='.png'):
+  """Adds the face image files one by one, found with :py:func:`os.walk`, as done formerly
+
+  This is only kept to compare the ingestion times, see :py:func:`compare_ingestions`
+
+  Returns
+  -------
+  int:
+    The number of added files
+
+  """
+  count = 0
   for root, dirs, files in os.walk(imagesdir, topdown=False):
     for name in files:
       image_filename = os.path.join(root, name)
@@ -59,9 +224,9 @@ def add_files(session, imagesdir, extension='.png'):
       if os.path.splitext(image_filename)[1] == extension:
 
         # get all the info, base on the file path
-        image_info = image_filename.replace(imagesdir, '')
+        image_info = os.path.relpath(image_filename, imagesdir).replace(os.sep, '/')
         infos = image_info.split('/')
-        
+
         client_id = int(infos[0])
         light = infos[1]
         device = infos[2].replace('SR300-', '')
@@ -70,19 +235,89 @@ def add_files(session, imagesdir, extension='.png'):
         if stream == 'color': modality = 'rgb'
         if stream == 'ir': modality = 'nir'
         if stream == 'depth': modality = 'depth'
-        
+
         # default pose is frontal
         pose = 'frontal'
         if 'yaw' in image_filename:
           pose = 'yaw'
         if 'pitch' in image_filename:
           pose = 'pitch'
-        
+
         stem = image_info[0:-len(extension)]
 
         logger.info("Adding file {}".format(stem))
         o = File(client_id=client_id, path=stem, light=light, device=device, pose=pose, modality=modality, recording=recording)
         session.add(o)
+        count += 1
+  return count
+
+
+def _bulk_insert(session, cls, rows):
+  """Inserts rows, given as dictionaries, in chunks of :py:data:`BULK_SIZE`"""
+  count = 0
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == BULK_SIZE:
+      session.bulk_insert_mappings(cls, chunk)
+      count += len(chunk)
+      chunk = []
+  if chunk:
+    session.bulk_insert_mappings(cls, chunk)
+    count += len(chunk)
+  return count
+
+
+def add_clients(session, imagesdir):
+  """Add clients
+
+  This function adds clients to the database. 
+
+  Parameters
+  ----------
+  session:
+    The session to the SQLite database 
+  imagesdir : :py:obj:str
+    The directory where the images have been extracted
+
+  Returns
+  -------
+  int:
+    The number of added clients
+
+  """
+  client_ids = sorted(int(d) for d in _client_directories(imagesdir))
+  logger.info("Adding {} clients".format(len(client_ids)))
+  return _bulk_insert(session, Client, ({'id': k, 'group': client_group(k)} for k in client_ids))
+
+def add_files(session, imagesdir, extension='.png', workers=8, states=None):
+  """ Add face images files.
+
+  This function adds the face image files to the database, scanned with
+  :py:func:`scan_files`, using bulk insertions.
+
+  Parameters
+  ----------
+  session:
+    The session to the SQLite database 
+  imagesdir : :py:obj:str
+    The directory where the images have been extracted
+  extension: :py:obj:str
+    The extension of the image file.
+  workers: int
+    The number of directories scanned at once
+  states: dict
+    If given, it is filled with the state of each client directory
+
+  Returns
+  -------
+  int:
+    The number of added files
+
+  """
+  count = _bulk_insert(session, File, (dict(zip(FILE_COLUMNS, f)) for f in scan_files(imagesdir, extension, workers, states=states)))
+  logger.info("Added {} files".format(count))
+  return count
 
 
 def add_protocols(session):
@@ -110,168 +345,160 @@ def add_protocols(session):
      image are RGB, and probes are coming from the target modality (i.e. either NIR or depth).
      These protocols are named in the following way: {mc, ud, uo}-rgb2{nir, depth}
 
+  The protocols are defined in :py:data:`bob.db.fargo.protocols.PROTOCOLS`.
+
   Parameters
   ----------
   session:
     The session to the SQLite database 
+
+  Returns
+  -------
+  :py:class:`collections.OrderedDict`:
+    The number of associated files and the time in seconds, per protocol
+
   """
-  from sqlalchemy import and_
+  import time
+  import collections
+  from .protocols import PROTOCOLS, GROUP_PURPOSES, compile_purpose
+
+  summary = collections.OrderedDict()
 
-  # enrollment images are also the same for all protocols
-  recordings_enroll = ['0']
- 
-  # now probes may change depending on the protocol
-  protocol_probes = {}
-  
-  # this is constant across protocols
-  device_probe = ['laptop', 'mobile']
-
-  ##########
-  ### MC ###
-  ##########
-  # matched controlled -> probes are controlled
-  session_probe = 'controlled'
-  recordings_probe = ['1']
-
-  # add the modalities
-  protocol_probes['mc-rgb'] = ['rgb', session_probe, device_probe, recordings_probe]
-  protocol_probes['mc-nir'] = ['nir', session_probe, device_probe, recordings_probe]
-  protocol_probes['mc-depth'] = ['depth', session_probe, device_probe, recordings_probe]
-  # heterogeneous
-  protocol_probes['mc-rgb2nir'] = [None , session_probe, device_probe, recordings_probe]
-  protocol_probes['mc-rgb2depth'] = [None, session_probe, device_probe, recordings_probe]
-
-  ##########
-  ### UD ###
-  ##########
-  # unmatched degraded -> probes are dark
-  session_probe = 'dark'
-  recordings_probe = ['0', '1']
-
-  # add the modalities
-  protocol_probes['ud-rgb'] = ['rgb', session_probe, device_probe, recordings_probe]
-  protocol_probes['ud-nir'] = ['nir', session_probe, device_probe, recordings_probe]
-  protocol_probes['ud-depth'] = ['depth', session_probe, device_probe, recordings_probe]
-  # heterogeneous
-  protocol_probes['ud-rgb2nir'] = [None , session_probe, device_probe, recordings_probe]
-  protocol_probes['ud-rgb2depth'] = [None, session_probe, device_probe, recordings_probe]
-
-  ##########
-  ### UO ###
-  ##########
-  # unmatched outdoor -> probes are outdoor
-  session_probe = 'outdoor'
-  recordings_probe = ['0', '1']
-
-  # add the modalities
-  protocol_probes['uo-rgb'] = ['rgb', session_probe, device_probe, recordings_probe]
-  protocol_probes['uo-nir'] = ['nir', session_probe, device_probe, recordings_probe]
-  protocol_probes['uo-depth'] = ['depth', session_probe, device_probe, recordings_probe]
-  # heterogeneous
-  protocol_probes['uo-rgb2nir'] = [None , session_probe, device_probe, recordings_probe]
-  protocol_probes['uo-rgb2depth'] = [None, session_probe, device_probe, recordings_probe]
-
-  ###############
-  ### POS-YAW ###
-  ###############
-  # unmatched pose -> probes are with varying yaw
-  session_probe = 'controlled'
-  recordings_probe = ['0', '1']
-  protocol_probes['pos-yaw'] = ['rgb', session_probe, device_probe, recordings_probe]
-  
-  #################
-  ### POS-PITCH ###
-  #################
-  # unmatched pose -> probes are with varying pitch
-  session_probe = 'controlled'
-  recordings_probe = ['0', '1']
-  protocol_probes['pos-pitch'] = ['rgb', session_probe, device_probe, recordings_probe]
- 
-  # the purpose list 
-  group_purpose_list = [('world', 'train'), ('dev', 'enroll'), ('dev', 'probe'), ('eval', 'enroll'), ('eval', 'probe')]
-  
   # add each protocol
-  for protocol_name in protocol_probes:
-  
+  for protocol_name, filters in PROTOCOLS.items():
+
+    start = time.perf_counter()
+    count = 0
     p = Protocol(protocol_name)
     logger.info("Adding protocol {}...".format(protocol_name))
     session.add(p)
     session.flush()
-    session.refresh(p)
-
-    modality = protocol_probes[protocol_name][0]
-    
-    # heterogeneous case
-    if modality is None:
-      if 'rgb2nir' in protocol_name:
-        target_modality = 'nir'
-      if 'rgb2depth' in protocol_name:
-        target_modality = 'depth'
-    
+
     # add protocol purposes
-    for group_purpose in group_purpose_list:
-     
-      group = group_purpose[0]
-      purpose = group_purpose[1]
+    for group, purpose in GROUP_PURPOSES:
+
       pu = ProtocolPurpose(p.id, group, purpose)
-      
       logger.info("  Adding protocol purpose ({}, {})...".format(group, purpose))
       session.add(pu)
       session.flush()
-      session.refresh(pu)
-
-      # first retrieve all files for the group 
-      q = session.query(File).join(Client).filter(Client.group == group).order_by(File.id)
-
-      # if purpose is train, we have controlled frontal images in any cases
-      if purpose == 'train':
-        q = q.filter(and_(File.light == 'controlled', File.pose == 'frontal'))
-        # now get the right modality
-
-        # if HETEROGENEOUS get 2 modalities for the WORLD set
-        if "rgb2nir" in p.name or "rgb2depth" in p.name:
-          if modality is not None:
-            q = q.filter(File.modality.in_([modality,"rgb"]))
-          else:
-            q = q.filter(File.modality.in_(["rgb", target_modality]))
-        else:
-          if modality is not None:
-            q = q.filter(File.modality.in_([modality]))
-          else:
-            q = q.filter(File.modality.in_([target_modality]))
- 
-      # for enroll, we have controlled frontal images, for the first recording for each device
-      if purpose == 'enroll':
-        q = q.filter(and_(File.light == 'controlled', File.pose == 'frontal', File.recording.in_(recordings_enroll)))
-        # now filter modality:
-        if modality is not None:
-          q = q.filter(File.modality == modality)
-        else:
-          q = q.filter(File.modality == 'rgb') # always rgb in heterogeneous case
-
-      # now the probes 
-      if purpose == 'probe':
-        # for probes, the number of recording depends on the protocol
-        q = q.filter(File.recording.in_(protocol_probes[protocol_name][3]))
-        # the light condition as well
-        q = q.filter(File.light == protocol_probes[protocol_name][1])
-        # the pose
-        if 'yaw' in protocol_name:
-          q = q.filter(File.pose == 'yaw')
-        elif 'pitch' in protocol_name:
-          q = q.filter(File.pose == 'pitch')
-        else:
-          q = q.filter(File.pose == 'frontal')
-        # the modality
-        if modality is not None:
-          q = q.filter(File.modality == modality)
-        else:
-          q = q.filter(File.modality == target_modality) # target modality in heterogeneous case
-
-      # now add the files
-      for k in q:
-        pu.files.append(k)
-      logger.info("added {} files".format(len(list(q))))
+
+      # now add the files, in a single INSERT ... SELECT
+      result = session.execute(compile_purpose(pu.id, group, filters[purpose]))
+      logger.info("added {} files".format(result.rowcount))
+      count += result.rowcount
+
+    summary[protocol_name] = (count, time.perf_counter() - start)
+
+  return summary
+
+
+def update_files(session, imagesdir, manifest, extension='.png', workers=8):
+  """ Updates the clients and files of the changed client directories
+
+  The client directories whose state (see :py:func:`client_states`)
+  differs from the manifest are scanned again: new files are added, files
+  with changed information are updated, and missing files are removed,
+  together with their protocol associations. The clients whose directory
+  was removed are removed as well.
+
+  Parameters
+  ----------
+  session:
+    The session to the SQLite database 
+  imagesdir : :py:obj:str
+    The directory where the images have been extracted
+  manifest: dict
+    The client directory states when the database was last written
+  extension: :py:obj:str
+    The extension of the image file.
+  workers: int
+    The number of directories scanned at once
+
+  Returns
+  -------
+  tuple:
+    The new client directory states, the sorted ids of the changed clients,
+    and the number of added, updated and removed files
+
+  """
+  from sqlalchemy import select
+
+  states = client_states(imagesdir, extension, workers)
+  changed = sorted(c for c in states if manifest.get(c) != states[c])
+  removed = sorted(c for c in manifest if c not in states)
+  client_ids = sorted(int(c) for c in changed + removed)
+  if not client_ids:
+    return states, client_ids, (0, 0, 0)
+  logger.info("Updating the files of {} clients".format(len(client_ids)))
+
+  # the associations of the changed clients are recomputed
+  session.execute(protocolPurpose_file_association.delete().where(
+      protocolPurpose_file_association.c.file_id.in_(select([File.id]).where(File.client_id.in_(client_ids)))))
+
+  known = dict((f[1], f) for f in session.query(File.id, File.path, File.client_id, File.light, File.device,
+      File.recording, File.modality, File.pose).filter(File.client_id.in_(client_ids)))
+  scanned = list(scan_files(imagesdir, extension, workers, clients=changed))
+
+  added, updated = [], []
+  for f in scanned:
+    row = dict(zip(FILE_COLUMNS, f))
+    if f[1] not in known:
+      added.append(row)
+    else:
+      k = known.pop(f[1])
+      if (k[2],) + tuple(k[3:]) != (f[0],) + tuple(f[2:]):
+        row['id'] = k[0]
+        updated.append(row)
+  deleted = sorted(k[0] for k in known.values())
+
+  new_clients = set(f[0] for f in scanned) - set(i for i, in session.query(Client.id).filter(Client.id.in_(client_ids)))
+  _bulk_insert(session, Client, ({'id': k, 'group': client_group(k)} for k in sorted(new_clients)))
+  # chunks stay below the number of variables allowed in an SQLite statement
+  for k in range(0, len(deleted), 500):
+    session.query(File).filter(File.id.in_(deleted[k:k + 500])).delete(synchronize_session=False)
+  session.bulk_update_mappings(File, updated)
+  _bulk_insert(session, File, added)
+  if removed:
+    session.query(Client).filter(Client.id.in_([int(c) for c in removed])).delete(synchronize_session=False)
+
+  logger.info("Added {}, updated {} and removed {} files".format(len(added), len(updated), len(deleted)))
+  return states, client_ids, (len(added), len(updated), len(deleted))
+
+
+def update_protocols(session, client_ids):
+  """ Recomputes the protocol associations of the files of some clients
+
+  The previous associations of these files must have been removed, see
+  :py:func:`update_files`.
+
+  Parameters
+  ----------
+  session:
+    The session to the SQLite database 
+  client_ids: list of int
+    The clients whose files are associated again
+
+  Returns
+  -------
+  :py:class:`collections.OrderedDict`:
+    The number of added associations and the time in seconds, per protocol
+
+  """
+  import time
+  import collections
+  from .protocols import PROTOCOLS, compile_purpose
+
+  summary = collections.OrderedDict()
+  if not client_ids:
+    return summary
+  q = session.query(ProtocolPurpose.id, Protocol.name, ProtocolPurpose.group, ProtocolPurpose.purpose).\
+      join(Protocol, ProtocolPurpose.protocol_id == Protocol.id).order_by(ProtocolPurpose.id)
+  for purpose_id, protocol_name, group, purpose in q.all():
+    start = time.perf_counter()
+    result = session.execute(compile_purpose(purpose_id, group, PROTOCOLS[protocol_name][purpose], client_ids))
+    count, seconds = summary.get(protocol_name, (0, 0.))
+    summary[protocol_name] = (count + result.rowcount, seconds + time.perf_counter() - start)
+  return summary
 
 
 def create_tables(args):
@@ -282,16 +509,86 @@ def create_tables(args):
     Base.metadata.create_all(engine)
 
 
+def set_build_pragmas(session):
+  """Disables the journal and the synchronous writes of the SQLite database
+
+  This speeds up the creation, which is simply restarted if interrupted.
+  It must be called before the first write of the session.
+
+  """
+  from sqlalchemy import text
+  session.execute(text('PRAGMA journal_mode=OFF'))
+  session.execute(text('PRAGMA synchronous=OFF'))
+
+
+def compare_ingestions(imagesdir, extension='.png', workers=8):
+  """Times the former and the bulk ingestion of the clients and files
+
+  Each pipeline fills its own scratch database, in a temporary directory.
+  The former one walks the images and adds each object to the session,
+  logging it, the bulk one scans the client directories in parallel and
+  inserts plain rows, with the build pragmas.
+
+  Returns
+  -------
+  list:
+    The (pipeline, files, seconds) of each ingestion pipeline
+
+  """
+  import time
+  import shutil
+  import tempfile
+  from bob.db.base.utils import create_engine_try_nolock, session_try_nolock
+
+  def former(session):
+    former_add_clients(session, imagesdir)
+    return former_add_files(session, imagesdir, extension)
+
+  def bulk(session):
+    set_build_pragmas(session)
+    add_clients(session, imagesdir)
+    return add_files(session, imagesdir, extension, workers)
+
+  directory = tempfile.mkdtemp(prefix='bob_db_fargo_')
+  retval = []
+  try:
+    for name, ingest in (('per-file', former), ('bulk', bulk)):
+      dbfile = os.path.join(directory, '%s.sql3' % name)
+      engine = create_engine_try_nolock('sqlite', dbfile)
+      Base.metadata.create_all(engine)
+      engine.dispose()
+      session = session_try_nolock('sqlite', dbfile)
+      start = time.perf_counter()
+      count = ingest(session)
+      session.commit()
+      retval.append((name, count, time.perf_counter() - start))
+      session.close()
+  finally:
+    shutil.rmtree(directory)
+  return retval
+
+
 # Driver API
 # ==========
 
 def create(args):
   """Creates or re-creates this database"""
 
+  import time
   from bob.db.base.utils import session_try_nolock
 
   print(args)
   dbfile = args.files[0]
+  workers = getattr(args, 'workers', 8)
+
+  update = getattr(args, 'update', False)
+  if update and args.recreate:
+    raise ValueError("The --recreate and --update options cannot be used together")
+  if update and not (os.path.exists(dbfile) and os.path.exists(manifest_file(dbfile))):
+    # the files of a database without manifest cannot be compared to the images
+    print("%s or its manifest does not exist, creating it from scratch" % dbfile)
+    update = False
+    args.recreate = True
 
   if args.recreate:
     if args.verbose and os.path.exists(dbfile):
@@ -304,14 +601,49 @@ def create(args):
 
   bob.core.log.set_verbosity_level(logger, args.verbose)
 
+  if getattr(args, 'compare_ingestion', False):
+    for name, count, seconds in compare_ingestions(args.imagesdir, workers=workers):
+      print("%-10s ingested %d files in %.3f s" % (name, count, seconds))
+
   # the real work...
-  create_tables(args)
-  s = session_try_nolock(args.type, args.files[0], echo=False)
-  add_clients(s, args.imagesdir)
-  add_files(s, args.imagesdir)
-  add_protocols(s)
-  s.commit()
-  s.close()
+  timings = []
+  summary = {}
+  def timed(stage, function, *arguments):
+    start = time.perf_counter()
+    count = function(*arguments)
+    if isinstance(count, dict):
+      # the per-protocol summary
+      summary.update(count)
+      count = sum(c for c, _ in count.values())
+    timings.append((stage, count, time.perf_counter() - start))
+
+  if update:
+    # only the changed client directories are scanned again
+    s = session_try_nolock(args.type, args.files[0], echo=False)
+    start = time.perf_counter()
+    states, client_ids, (added, updated, removed) = update_files(s, args.imagesdir,
+        read_manifest(manifest_file(dbfile)), '.png', workers)
+    timings.append(('files', added + updated + removed, time.perf_counter() - start))
+    timed('protocols', update_protocols, s, client_ids)
+    s.commit()
+    s.close()
+    print("%d changed clients: %d files added, %d updated and %d removed" % (len(client_ids), added, updated, removed))
+  else:
+    states = {}
+    create_tables(args)
+    s = session_try_nolock(args.type, args.files[0], echo=False)
+    set_build_pragmas(s)
+    timed('clients', add_clients, s, args.imagesdir)
+    timed('files', add_files, s, args.imagesdir, '.png', workers, states)
+    timed('protocols', add_protocols, s)
+    s.commit()
+    s.close()
+  write_manifest(manifest_file(dbfile), states)
+
+  for protocol_name, (count, seconds) in summary.items():
+    print("%-14s %8d associated files in %.3f s" % (protocol_name, count, seconds))
+  for stage, count, seconds in timings:
+    print("%-14s %8d rows in %.3f s" % (stage, count, seconds))
 
   return 0
 
@@ -323,8 +655,14 @@ def add_command(subparsers):
 
   parser.add_argument('-R', '--recreate', action='store_true', default=False,
                       help="If set, I'll first erase the current database")
+  parser.add_argument('-U', '--update', action='store_true', default=False,
+                      help="If set, only the client directories changed since the last creation are scanned again")
   parser.add_argument('-v', '--verbose', action='count', default=0,
                       help="Do SQL operations in a verbose way")
+  parser.add_argument('-w', '--workers', type=int, default=8,
+                      help="The number of image directories scanned at once")
+  parser.add_argument('--compare-ingestion', action='store_true', default=False,
+                      help="If set, the bulk ingestion of the clients and files is first timed against the former per-file ingestion, in scratch databases")
   parser.add_argument('imagesdir', action='store', metavar='DIR',
                       help="The path to the extracted images of the FARGO database")
 
@@ -8,42 +8,99 @@ import os
 import sys
 from bob.db.base.driver import Interface as BaseInterface
 
+def _format_entries(files, directory, extension, format, protocol=None):
+  """Formats the files to dump, one string per file"""
+  if format == 'jsonl':
+    import json
+    return (json.dumps({'protocol': protocol, 'id': f.id, 'client_id': f.client_id, 'modality': f.modality,
+        'path': f.make_path(directory=directory, extension=extension)}) + '\n' for f in files)
+  separator = '\0' if format == 'nul' else '\n'
+  return (f.make_path(directory=directory, extension=extension) + separator for f in files)
+
+
+def _filter_entries(files, modality=None, model_ids=None):
+  """Keeps the files of the given modality and clients
+
+  :py:meth:`bob.db.fargo.Database.objects` only filters the modality of the
+  training files, and the clients of the training and enrollment files.
+
+  """
+  if modality:
+    files = (f for f in files if f.modality == modality)
+  if model_ids:
+    model_ids = set(model_ids)
+    files = (f for f in files if f.client_id in model_ids)
+  return files
+
+
+def _write_buffered(output, entries, chunk_size=4096):
+  """Writes entries in large chunks, instead of one write per entry"""
+  chunk = []
+  for entry in entries:
+    chunk.append(entry)
+    if len(chunk) == chunk_size:
+      output.write(''.join(chunk))
+      chunk = []
+  if chunk:
+    output.write(''.join(chunk))
+
+
 def dumplist(args):
   """Dumps lists of files based on your criteria"""
 
+  # the lists of all protocols can only be told apart in files, or with the protocol of each JSON entry
+  if args.all and not args.output_dir and args.format != 'jsonl':
+    raise ValueError("Dumping all protocols requires an output directory (--output-dir) or the 'jsonl' format")
+
   from .query import Database
   db = Database()
 
-  r = db.objects(
-      protocol=args.protocol,
-      purposes=args.purpose,
-      groups=args.group,
-  )
-
   output = sys.stdout
   if args.selftest:
     from bob.db.base.utils import null
     output = null()
 
-  for f in r:
-    output.write('%s\n' % f.make_path(directory=args.directory,extension=args.extension))
+  query = dict(purposes=args.purpose, groups=args.group, model_ids=args.model_ids, modality=args.modality)
+
+  if not args.all and not args.output_dir:
+    # a single list, streamed from the database
+    r = _filter_entries(db.iter_objects(protocol=args.protocol, **query), args.modality, args.model_ids)
+    _write_buffered(output, _format_entries(r, args.directory, args.extension, args.format, args.protocol))
+    return 0
+
+  # several lists, gathered in a single pass
+  protocols = db.protocol_names() if args.all else [args.protocol]
+  lists = db.objects_many([dict(query, protocol=p) for p in protocols])
+
+  if args.output_dir and not args.selftest and not os.path.exists(args.output_dir):
+    os.makedirs(args.output_dir)
+  suffix = '.jsonl' if args.format == 'jsonl' else '.lst'
+  for protocol, r in zip(protocols, lists):
+    r = _filter_entries(r, args.modality, args.model_ids)
+    entries = _format_entries(r, args.directory, args.extension, args.format, protocol)
+    if args.output_dir and not args.selftest:
+      with open(os.path.join(args.output_dir, '%s%s' % (protocol or 'all', suffix)), 'w', buffering=1 << 20) as f:
+        _write_buffered(f, entries)
+    else:
+      _write_buffered(output, entries)
 
   return 0
 
 def checkfiles(args):
   """Checks existence of files based on your criteria"""
 
+  # the manifest is stored next to the images, never in the current directory
+  if args.verify and not (args.directory or args.manifest):
+    raise ValueError("Verifying the files requires their directory (--directory) or a checksum manifest (--manifest)")
+
   from .query import Database
+  from .check import find_missing, write_report
   db = Database()
 
-  r = db.objects()
+  r = db.objects(as_table=True)
 
-  # go through all files, check if they are available on the filesystem
-  good = []
-  bad = []
-  for f in r:
-    if os.path.exists(f.make_path(args.directory, args.extension)): good.append(f)
-    else: bad.append(f)
+  # list each directory once, several directories at a time
+  bad = find_missing(r, args.directory, args.extension, args.workers)
 
   # report
   output = sys.stdout
@@ -57,6 +114,138 @@ def checkfiles(args):
     output.write('%d files (out of %d) were not found at "%s"\n' % \
         (len(bad), len(r), args.directory))
 
+  # hash the files which changed since the last verification
+  corrupted = []
+  if args.verify:
+    from .check import CHECKSUM_MANIFEST, read_manifest, write_manifest, verify_files
+    manifest_file = args.manifest or os.path.join(args.directory, CHECKSUM_MANIFEST)
+    missing = set(f.id for f in bad)
+    manifest, corrupted, hashed = verify_files([f for f in r if f.id not in missing], args.directory, args.extension,
+        read_manifest(manifest_file), args.workers, args.rehash)
+    write_manifest(manifest_file, manifest)
+    for f in corrupted:
+      output.write('Corrupted file "%s"\n' % f.make_path(args.directory, args.extension))
+    output.write('%d files (out of %d) are corrupted, %d files were hashed\n' % \
+        (len(corrupted), len(r) - len(bad), hashed))
+
+  if args.report:
+    with open(args.report, 'w', newline='') as f:
+      write_report(f, bad, len(r), args.directory, args.extension, args.format, corrupted)
+
+  return 0
+
+def export(args):
+  """Exports the file lists, for use without SQLAlchemy"""
+
+  from .query import Database
+  from .filelist import write_file_lists
+  db = Database()
+
+  counts = write_file_lists(db, args.output_directory)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  for filename in sorted(counts):
+    output.write('%d lines written to "%s"\n' % (counts[filename], os.path.join(args.output_directory, filename)))
+
+  return 0
+
+def pack_annotations(args):
+  """Consolidates the annotation files into a single memory-mapped array"""
+
+  from .query import Database
+  db = Database(annotation_directory=args.annotation_directory,
+      annotation_extension=args.extension, annotation_type=args.type)
+
+  count = db.pack_annotations()
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  output.write('annotations of %d files were packed in "%s"\n' % (count, args.annotation_directory))
+
+  return 0
+
+def pack(args):
+  """Decodes images once, and packs them in one array per modality"""
+
+  from .query import Database
+  from .packed import pack_images
+  db = Database()
+
+  r = db.objects(protocol=args.protocol, groups=args.group)
+  counts = pack_images(r, args.directory, args.extension, args.output_directory,
+      workers=args.workers, batch_size=args.batch_size)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  for modality in sorted(counts):
+    output.write('%d %s images packed in "%s"\n' % (counts[modality], modality, args.output_directory))
+
+  return 0
+
+def benchmark(args):
+  """Measures the latency of the queries, and the memory used"""
+
+  from .benchmark import benchmark_queries
+  protocols = [args.protocol] if args.protocol else None
+  if args.selftest:
+    protocols = protocols or ['mc-rgb']
+  results = benchmark_queries(args.repeats, protocols, use_index=args.use_index, cache_size=args.cache_size)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  for r in results['queries']:
+    output.write('%-9s %-14s %-5s %-7s %5d rows' % (r['method'], r['protocol'], r['groups'], r.get('purposes', ''), r['rows']))
+    for mode in ('cold', 'warm'):
+      output.write('  %s p50 %8.3f ms p95 %8.3f ms max %8.3f ms' % (mode, 1000 * r[mode]['p50'], 1000 * r[mode]['p95'], 1000 * r[mode]['max']))
+    output.write('\n')
+  output.write('%d queries measured in %.1f s, peak RSS %.1f MB\n' % (len(results['queries']), results['seconds'], results['peak_rss'] / 2.**20))
+
+  if args.output and not args.selftest:
+    import json
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=1)
+
+  return 0
+
+def serve(args):
+  """Serves the queries to other processes, through a Unix socket"""
+
+  from .server import serve as serve_forever, default_socket, RemoteDatabase
+  socket = args.socket or default_socket(create=True)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  def ready(server):
+    output.write('serving the FARGO database on "%s"\n' % socket)
+    output.flush()
+    if args.selftest:
+      # answer a single query, and stop
+      import threading
+      def query():
+        db = RemoteDatabase(socket)
+        db.objects(protocol='mc-rgb', groups='dev', purposes='enroll')
+        db.close()
+        server.shutdown()
+      threading.Thread(target=query).start()
+
+  serve_forever(socket, args.cache_size, ready)
+
   return 0
 
 class Interface(BaseInterface):
@@ -69,9 +258,8 @@ class Interface(BaseInterface):
     return pkg_resources.require('bob.db.%s' % self.name())[0].version
 
   def files(self):
-    from pkg_resources import resource_filename
-    raw_files = ('db.sql3',)
-    return [resource_filename(__name__, k) for k in raw_files]
+    from .utils import database_file
+    return [database_file()]
 
   def type(self):
     return 'sqlite'
@@ -83,6 +271,7 @@ class Interface(BaseInterface):
     subparsers = self.setup_parser(parser, "FARGO database", docs)
 
     import argparse
+    from .protocols import PROTOCOLS
     
     # example: get the "create" action from a submodule
     from .create import add_command as create_command
@@ -92,9 +281,15 @@ class Interface(BaseInterface):
     parser = subparsers.add_parser('dumplist', help=dumplist.__doc__)
     parser.add_argument('-d', '--directory', default='', help="if given, this path will be prepended to every entry returned.")
     parser.add_argument('-e', '--extension', default='', help="if given, this extension will be appended to every entry returned.")
-    parser.add_argument('-p', '--protocol', help="the protocol", choices=('mc-rgb', 'ud-rgb', 'uo-rgb', 'mc-nir', 'ud-nir', 'uo-nir', 'mc-depth', 'ud-depth', 'uo-depth', 'pos-yaw', 'pos-pitch'))
+    protocols = parser.add_mutually_exclusive_group()
+    protocols.add_argument('-p', '--protocol', help="the protocol", choices=list(PROTOCOLS))
+    protocols.add_argument('-a', '--all', action='store_true', help="if set, the list of every protocol is dumped, in a single pass over the database. Requires --output-dir, or the 'jsonl' format.")
     parser.add_argument('-P', '--purpose', help="if given, this value will limit the output files to those designed for the given purposes.", choices=('enroll', 'probe', 'train'))
     parser.add_argument('-g', '--group', help="if given, this value will limit the output files to those belonging to a particular protocolar group.", choices=('dev', 'eval', 'world'))
+    parser.add_argument('-m', '--modality', help="if given, this value will limit the output files to those of the given modality, in all groups and purposes.", choices=('rgb', 'nir', 'depth'))
+    parser.add_argument('-M', '--model-ids', type=int, nargs='+', help="if given, this value will limit the output files to those of the given clients, in all groups and purposes (including the probes).")
+    parser.add_argument('-f', '--format', default='lines', help="The output format: one path per line, NUL-delimited paths, or one JSON object per line.", choices=('lines', 'nul', 'jsonl'))
+    parser.add_argument('-o', '--output-dir', help="if given, the list of each protocol is written to '<protocol>.lst' (or '.jsonl') in this directory, instead of the standard output.")
     parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
     parser.set_defaults(func=dumplist) #action
 
@@ -103,6 +298,55 @@ class Interface(BaseInterface):
     parser.add_argument('-l', '--list-directory', required=True, help="The directory which contains the file lists.")
     parser.add_argument('-d', '--directory', dest="directory", default='', help="if given, this path will be prepended to every entry returned.")
     parser.add_argument('-e', '--extension', dest="extension", default='', help="if given, this extension will be appended to every entry returned.")
+    parser.add_argument('-r', '--report', help="if given, the missing files are written to this file, grouped by client, session, device and recording.")
+    parser.add_argument('-f', '--format', default='json', help="The format of the report.", choices=('json', 'csv'))
+    parser.add_argument('-w', '--workers', type=int, default=8, help="The number of directories listed, or files hashed, at once.")
+    parser.add_argument('--verify', action='store_true', help="if set, the content of the files which changed since the last verification is hashed, and PNG files are checked for truncation.")
+    parser.add_argument('-m', '--manifest', help="The checksum manifest used by --verify, 'checksums.json' in the images directory (--directory) by default.")
+    parser.add_argument('--rehash', action='store_true', help="if set, --verify hashes all files, and reports files modified without changing their size and modification time.")
     parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
 
     parser.set_defaults(func=checkfiles) #action
+
+    # the "export" action
+    parser = subparsers.add_parser('export', help=export.__doc__)
+    parser.add_argument('-o', '--output-directory', required=True, help="The directory where the file lists are written.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=export) #action
+
+    # the "pack-annotations" action
+    parser = subparsers.add_parser('pack-annotations', help=pack_annotations.__doc__)
+    parser.add_argument('-a', '--annotation-directory', required=True, help="The directory containing the annotation files.")
+    parser.add_argument('-e', '--extension', default='.json', help="The extension of the annotation files.")
+    parser.add_argument('-t', '--type', default='json', help="The type of the annotation files.", choices=('eyecenter', 'named', 'idiap', 'json'))
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=pack_annotations) #action
+
+    # the "pack" action
+    parser = subparsers.add_parser('pack', help=pack.__doc__)
+    parser.add_argument('-d', '--directory', required=True, help="The directory containing the extracted images.")
+    parser.add_argument('-e', '--extension', default='.png', help="The extension of the extracted images.")
+    parser.add_argument('-o', '--output-directory', required=True, help="The directory where the packed images are written.")
+    parser.add_argument('-p', '--protocol', help="if given, only the images of this protocol are packed.")
+    parser.add_argument('-g', '--group', help="if given, only the images of this group are packed.", choices=('dev', 'eval', 'world'))
+    parser.add_argument('-w', '--workers', type=int, default=4, help="The number of decoding threads.")
+    parser.add_argument('-b', '--batch-size', type=int, default=256, help="The number of images decoded at once.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=pack) #action
+
+    # the "benchmark" action
+    parser = subparsers.add_parser('benchmark', help=benchmark.__doc__)
+    parser.add_argument('-r', '--repeats', type=int, default=5, help="The number of runs of each query, cold and warm.")
+    parser.add_argument('-p', '--protocol', help="if given, only the queries of this protocol are measured.", choices=list(PROTOCOLS))
+    parser.add_argument('-o', '--output', help="if given, the measures are written to this JSON file.")
+    parser.add_argument('-i', '--use-index', action='store_true', help="if set, the queries are answered by the in-memory protocol index.")
+    parser.add_argument('-c', '--cache-size', type=int, default=128, help="The number of query results cached by each database.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=benchmark) #action
+
+    # the "serve" action
+    parser = subparsers.add_parser('serve', help=serve.__doc__)
+    parser.add_argument('-s', '--socket', help="The Unix socket the server listens on, a socket private to the current user by default.")
+    parser.add_argument('-c', '--cache-size', type=int, default=128, help="The number of query results cached by the server.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=serve) #action
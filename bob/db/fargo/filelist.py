@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Flat-file version of the FARGO database, which does not need SQLAlchemy
+
+The file lists are exported from ``db.sql3`` into a directory containing
+three CSV files:
+
+  - ``clients.csv``: one (id, group) line per client
+  - ``files.csv``: one (id, client_id, light, device, recording, modality,
+    pose, path) line per file
+  - ``protocols.csv``: one (protocol, group, purpose, file_id) line per file
+    of each protocol purpose, the protocols being in the order of the
+    database
+
+"""
+
+import os
+import csv
+import collections
+
+import bob.db.base
+
+from .index import ProtocolIndex
+from .table import FileTable
+
+
+CLIENTS_FILE = 'clients.csv'
+FILES_FILE = 'files.csv'
+PROTOCOLS_FILE = 'protocols.csv'
+
+
+def write_file_lists(db, directory):
+  """Exports the clients, files and protocols of a database as CSV files
+
+  Parameters
+  ----------
+  db: :py:class:`bob.db.fargo.Database`
+    The database to export
+  directory: str
+    The directory where the CSV files are written
+
+  Returns
+  -------
+  dict:
+    The number of lines written in each file
+
+  """
+  from .models import File, Client, Protocol
+
+  if not os.path.exists(directory):
+    os.makedirs(directory)
+
+  def write(filename, header, rows):
+    count = 0
+    with open(os.path.join(directory, filename), 'w', newline='') as f:
+      writer = csv.writer(f, lineterminator='\n')
+      writer.writerow(header)
+      for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+  retval = {}
+  retval[CLIENTS_FILE] = write(CLIENTS_FILE, ('id', 'group'),
+      db.query(Client.id, Client.group).order_by(Client.id))
+  retval[FILES_FILE] = write(FILES_FILE, FileTable.columns,
+      db.query(File.id, File.client_id, File.light, File.device, File.recording, File.modality, File.pose, File.path).order_by(File.id))
+  retval[PROTOCOLS_FILE] = write(PROTOCOLS_FILE, ('protocol', 'group', 'purpose', 'file_id'),
+      db._association_rows().order_by(Protocol.id))
+  return retval
+
+
+def _read(directory, filename):
+  """Reads the rows of a CSV file, skipping its header"""
+  with open(os.path.join(directory, filename), newline='') as f:
+    reader = csv.reader(f)
+    next(reader)
+    return list(reader)
+
+
+class ClientRow(object):
+  """Lightweight client of the FARGO database
+
+  Attributes
+  ----------
+  id: int
+    The client (subject) id.
+  group: str
+    The group this client belongs to (either 'world', 'dev' or 'eval')
+
+  """
+
+  __slots__ = ('id', 'group')
+
+  def __init__(self, id, group):
+    self.id = id
+    self.group = group
+
+  def __repr__(self):
+    return "Client('%s', '%s')" % (self.id, self.group)
+
+
+class FileListDatabase(bob.db.base.Database):
+  """FARGO database read from exported file lists
+
+  It provides the query API of :py:class:`bob.db.fargo.Database`, and
+  returns the same files, as :py:class:`bob.db.fargo.table.FileRow`
+  objects, without importing SQLAlchemy. The file lists are created
+  with ``bob_dbmanage.py fargo export``.
+
+  Attributes
+  ----------
+  directory: str
+    The directory containing the exported file lists
+  original_directory: str
+    Path where the database is stored
+  original_extension: str
+    Extension of files in the database
+
+  """
+
+  group_choices = ('world', 'dev', 'eval')
+  purpose_choices = ('train', 'enroll', 'probe')
+
+  def __init__(self, directory, original_directory=None, original_extension=None, protocol='mc-rgb'):
+    """ Init function
+
+    Parameters
+    ----------
+    directory: str
+      The directory containing the exported file lists
+    original_directory: str
+      Path where the database is stored
+    original_extension: str
+      Extension of files in the database
+
+    """
+    super(FileListDatabase, self).__init__(original_directory, original_extension)
+    self.directory = directory
+    self.protocol = protocol
+    self._index = None
+    self._table = None
+    self._clients = None
+
+  def _load(self):
+    """Reads the file lists, on first use"""
+    if self._index is None:
+      clients = [(int(i), g) for i, g in _read(self.directory, CLIENTS_FILE)]
+      files = _read(self.directory, FILES_FILE)
+      table = FileTable.from_rows(sorted((int(r[0]), int(r[1])) + tuple(r[2:]) for r in files))
+      associations = [(p, g, u, int(i)) for p, g, u, i in _read(self.directory, PROTOCOLS_FILE)]
+      # the protocols, in the order of the database
+      protocols = list(collections.OrderedDict((a[0], None) for a in associations))
+
+      self._clients = dict((i, ClientRow(i, g)) for i, g in clients)
+      self._table = table
+      self._index = ProtocolIndex(associations,
+          zip(table.id.tolist(), table.client_id.tolist(), table.column('modality').tolist()),
+          clients, protocols)
+    return self._index
+
+  @property
+  def modalities(self):
+    return ['rgb', 'nir', 'depth']
+
+  def groups(self, protocol=None):
+    """Returns the names of all registered groups
+
+    Parameters
+    ----------
+    protocol: str
+      ignored, since the group are the same across protocols.
+
+    """
+    return self.group_choices
+
+  def purposes(self):
+    """Returns purposes
+
+    """
+    return self.purpose_choices
+
+  def protocol_names(self):
+    """Returns all registered protocol names
+
+    """
+    return list(self._load().protocols)
+
+  def clients(self, protocol=None, groups=None):
+    """Returns a set of clients for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.clients`
+
+    """
+    groups = self.check_parameters_for_validity(groups, "group", self.groups())
+    index = self._load()
+    return [self._clients[k] for k in index.client_ids(groups)]
+
+  def models(self, protocol=None, groups=None):
+    """Returns a set of models for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.models`
+
+    """
+    return self.clients(protocol, groups)
+
+  def model_ids(self, protocol=None, groups=None):
+    """Returns a set of models ids for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.model_ids`
+
+    """
+    return [model.id for model in self.models(protocol, groups)]
+
+  def client(self, id):
+    """Returns the client object of the specified id.
+
+    Raises
+    ------
+    KeyError:
+      if the client does not exist.
+
+    """
+    self._load()
+    return self._clients[id]
+
+  def objects(self, protocol=None, purposes=None, model_ids=None, groups=None, modality=None, as_table=False):
+    """Returns a set of Files for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.objects`
+
+    Returns
+    -------
+    lst:
+      A list of :py:class:`bob.db.fargo.table.FileRow` which have the given
+      properties, or a :py:class:`bob.db.fargo.table.FileTable` if
+      ``as_table`` is set.
+
+    """
+    protocol = self.check_parameters_for_validity(protocol, "protocol", self.protocol_names())
+    purposes = self.check_parameters_for_validity(purposes, "purpose", self.purposes())
+    groups = self.check_parameters_for_validity(groups, "group", self.groups())
+    modality = self.check_parameters_for_validity(modality, "modality", self.modalities)
+
+    from collections.abc import Iterable
+    if(model_ids is None):
+      model_ids = ()
+    elif(not isinstance(model_ids, Iterable)):
+      model_ids = (model_ids,)
+
+    ids = self._load().lookup(protocol, purposes, tuple(model_ids), groups, modality)
+    table = self._table[self._table.positions(ids)]
+    return table if as_table else list(table)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""In-memory index of the FARGO protocol file lists
+"""
+
+import collections
+import numpy
+
+
+ComparisonPairs = collections.namedtuple('ComparisonPairs',
+    ('model_ids', 'enroll_ids', 'enroll_models', 'probe_ids', 'probe_client_ids', 'model_index', 'probe_index'))
+ComparisonPairs.__doc__ = """Model/probe comparisons of a group, as NumPy arrays
+
+Attributes
+----------
+model_ids: :py:class:`numpy.ndarray`
+  The sorted model (client) ids, of shape ``(M,)``
+enroll_ids: :py:class:`numpy.ndarray`
+  The ids of all enrollment files, sorted by model
+enroll_models: :py:class:`numpy.ndarray`
+  For each enrollment file, the position of its model in ``model_ids``
+probe_ids: :py:class:`numpy.ndarray`
+  The sorted ids of the probe files, of shape ``(P,)``
+probe_client_ids: :py:class:`numpy.ndarray`
+  The client id of each probe file
+model_index: :py:class:`numpy.ndarray`
+  The row of each comparison in a ``(M, P)`` score matrix, of shape ``(M*P,)``
+probe_index: :py:class:`numpy.ndarray`
+  The column of each comparison in a ``(M, P)`` score matrix, of shape ``(M*P,)``
+"""
+
+
+class ProtocolIndex(object):
+  """In-memory index of the protocol file lists
+
+  The association table between files and protocol purposes is loaded
+  once and split into sorted arrays of file ids, one per
+  (protocol, group, purpose, modality). Queries are then answered with
+  set operations on these arrays, without going through SQLite.
+
+  This class only holds plain data (strings and NumPy arrays).
+
+  Attributes
+  ----------
+  protocols: list of str
+    The names of all indexed protocols
+  purposes: list of str
+    The names of all purposes found in the association table
+  modalities: list of str
+    The names of all modalities found in the association table
+  client_of: :py:class:`numpy.ndarray`
+    The client id of each file, indexed by file id
+
+  """
+
+  def __init__(self, associations, files, clients, protocols):
+    """ Init function
+
+    Parameters
+    ----------
+    associations: iterable of tuple
+      (protocol, group, purpose, file_id) rows of the association table
+    files: iterable of tuple
+      (file_id, client_id, modality) rows of the file table
+    clients: iterable of tuple
+      (client_id, group) rows of the client table
+    protocols: iterable of str
+      The names of all registered protocols
+
+    """
+    self.protocols = [str(p) for p in protocols]
+
+    files = list(files)
+    size = max([f[0] for f in files]) + 1 if files else 0
+    self.client_of = numpy.full(size, -1, dtype=numpy.int64)
+    modality_of = {}
+    for file_id, client_id, modality in files:
+      self.client_of[file_id] = client_id
+      modality_of[file_id] = str(modality)
+
+    lists = {}
+    for protocol, group, purpose, file_id in associations:
+      key = (str(protocol), str(group), str(purpose), modality_of[file_id])
+      lists.setdefault(key, []).append(file_id)
+    self._lists = dict((k, numpy.unique(numpy.array(v, dtype=numpy.int64))) for k, v in lists.items())
+    self.purposes = sorted(set(k[2] for k in self._lists))
+    self.modalities = sorted(set(k[3] for k in self._lists))
+
+    self._clients = {}
+    for client_id, group in sorted(clients):
+      self._clients.setdefault(str(group), []).append(client_id)
+
+
+  def file_ids(self, protocol, group, purpose, modalities):
+    """Returns the sorted file ids of one protocol purpose
+
+    Parameters
+    ----------
+    protocol: str
+      The protocol name
+    group: str
+      The group ('world', 'dev' or 'eval')
+    purpose: str
+      The purpose ('train', 'enroll' or 'probe')
+    modalities: tuple of str
+      The modalities to retrieve
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      The sorted file ids
+
+    """
+    parts = [self._lists.get((protocol, group, purpose, m)) for m in modalities]
+    parts = [p for p in parts if p is not None]
+    if not parts:
+      return numpy.array([], dtype=numpy.int64)
+    if len(parts) == 1:
+      return parts[0]
+    return numpy.unique(numpy.concatenate(parts))
+
+
+  def lookup(self, protocol, purposes, model_ids, groups, modality):
+    """Returns the sorted ids of the files matching a query
+
+    The semantics are the ones of :py:meth:`bob.db.fargo.Database.objects`,
+    and all parameters must already have been checked for validity.
+
+    Parameters
+    ----------
+    protocol: tuple of str
+      The protocols
+    purposes: tuple of str
+      The purposes, ignored for the 'world' group
+    model_ids: tuple of int
+      The model ids, ignored for probes. If empty, no filter is applied.
+    groups: tuple of str
+      The groups
+    modality: tuple of str
+      The modalities, only applied to the 'world' group
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      The sorted and unique file ids
+
+    """
+    filtered = []
+    unfiltered = []
+    for p in protocol:
+      if 'world' in groups:
+        for purpose in self.purposes:
+          filtered.append(self.file_ids(p, 'world', purpose, modality))
+      if 'dev' in groups or 'eval' in groups:
+        for g in groups:
+          if 'enroll' in purposes:
+            filtered.append(self.file_ids(p, g, 'enroll', self.modalities))
+          # dense probing -> don't filter by model_ids
+          if 'probe' in purposes:
+            unfiltered.append(self.file_ids(p, g, 'probe', self.modalities))
+
+    if filtered and model_ids:
+      ids = numpy.concatenate(filtered)
+      filtered = [ids[numpy.isin(self.client_of[ids], model_ids)]]
+    parts = filtered + unfiltered
+    if not parts:
+      return numpy.array([], dtype=numpy.int64)
+    return numpy.unique(numpy.concatenate(parts))
+
+
+  def client_ids(self, groups):
+    """Returns the ids of the clients of the given groups
+
+    Parameters
+    ----------
+    groups: tuple of str
+      The groups ('world', 'dev' or 'eval')
+
+    Returns
+    -------
+    lst:
+      The client ids, group after group, sorted within each group.
+
+    """
+    retval = []
+    for g in ('world', 'dev', 'eval'):
+      if g in groups:
+        retval += self._clients.get(g, [])
+    return retval
+
+
+  def comparison_pairs(self, protocol, group):
+    """Returns all model/probe comparisons of a group
+
+    Since probing is dense, every model is compared to every probe.
+
+    Parameters
+    ----------
+    protocol: str
+      The protocol name
+    group: str
+      The group ('dev' or 'eval')
+
+    Returns
+    -------
+    :py:class:`ComparisonPairs`:
+      The models, enrollment files, probe files and score matrix indices
+
+    """
+    enroll_ids = self.file_ids(protocol, group, 'enroll', self.modalities)
+    enroll_clients = self.client_of[enroll_ids]
+    order = numpy.argsort(enroll_clients, kind='mergesort')
+    enroll_ids, enroll_clients = enroll_ids[order], enroll_clients[order]
+    model_ids, enroll_models = numpy.unique(enroll_clients, return_inverse=True)
+
+    probe_ids = self.file_ids(protocol, group, 'probe', self.modalities)
+    m, p = len(model_ids), len(probe_ids)
+    return ComparisonPairs(model_ids, enroll_ids, enroll_models, probe_ids, self.client_of[probe_ids],
+        numpy.repeat(numpy.arange(m), p), numpy.tile(numpy.arange(p), m))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Parallel loading of FARGO images into preallocated arrays
+
+The images keep the layout of :py:func:`bob.io.base.load`, with the image
+index first: ``(N, H, W)`` for gray and depth images, and ``(N, C, H, W)``
+for color images. This planar layout is the one used by Bob, and by the
+packed images of :py:mod:`bob.db.fargo.packed`. Channels-last arrays, with
+the ``(N, H, W, C)`` layout, are obtained without copy with
+``numpy.moveaxis(images, 1, -1)``.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+
+def load_stack(paths, workers=4, load=None, pool=None):
+  """Loads images of identical shape into a single array
+
+  The first image is decoded to allocate the array, the others are then
+  decoded in a thread pool and directly copied into their slot.
+
+  Parameters
+  ----------
+  paths: list of str
+    The image files
+  workers: int
+    The number of decoding threads
+  load: callable
+    The function decoding a file, :py:func:`bob.io.base.load` by default
+  pool: :py:class:`concurrent.futures.ThreadPoolExecutor`
+    The decoding threads, if given, ``workers`` is then ignored
+
+  Returns
+  -------
+  :py:class:`numpy.ndarray`:
+    The images, stacked along the first dimension
+
+  Raises
+  ------
+  ValueError:
+    if the images do not all have the same shape
+
+  """
+  if load is None:
+    import bob.io.base
+    load = bob.io.base.load
+  if not paths:
+    return numpy.empty((0,))
+
+  first = load(paths[0])
+  retval = numpy.empty((len(paths),) + first.shape, dtype=first.dtype)
+  retval[0] = first
+
+  def _load(k):
+    data = load(paths[k])
+    if data.shape != first.shape:
+      raise ValueError("Image '%s' has shape %s, while '%s' has shape %s" % (paths[k], data.shape, paths[0], first.shape))
+    retval[k] = data
+
+  def _load_all(pool):
+    # consume the results, so that errors are raised here
+    for _ in pool.map(_load, range(1, len(paths))):
+      pass
+
+  if len(paths) > 1:
+    if pool is not None:
+      _load_all(pool)
+    else:
+      with ThreadPoolExecutor(max(1, workers)) as pool:
+        _load_all(pool)
+  return retval
+
+
+def load_batch(files, directory=None, extension=None, workers=4, load=None, pool=None):
+  """Loads images, stacked per modality
+
+  Parameters
+  ----------
+  files: list
+    The files, with ``make_path`` and ``modality``
+  directory: str
+    The directory containing the images
+  extension: str
+    The extension of the images
+  workers: int
+    The number of decoding threads
+  load: callable
+    The function decoding a file, :py:func:`bob.io.base.load` by default
+  pool: :py:class:`concurrent.futures.ThreadPoolExecutor`
+    The decoding threads, if given, ``workers`` is then ignored. By
+    default, a pool is created for the batch, and shared by its modalities
+
+  Returns
+  -------
+  dict:
+    For each modality, the array of its images, in the order of ``files``
+
+  """
+  paths = collections.OrderedDict()
+  for f in files:
+    paths.setdefault(f.modality, []).append(f.make_path(directory, extension))
+  if pool is None:
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+      return load_batch(files, directory, extension, workers, load, pool)
+  return collections.OrderedDict((m, load_stack(p, workers, load, pool)) for m, p in paths.items())
+
+
+def iter_batches(files, batch_size, directory=None, extension=None, workers=4, prefetch=True, load=None):
+  """Loads images batch after batch
+
+  Parameters
+  ----------
+  files: list
+    The files, with ``make_path`` and ``modality``
+  batch_size: int
+    The number of files per batch
+  directory, extension, workers, load:
+    See :py:func:`load_batch`
+  prefetch: bool
+    If set, the next batch is loaded in the background while the current
+    one is processed
+
+  Yields
+  ------
+  tuple:
+    The files of the batch, and their images as returned by
+    :py:func:`load_batch`
+
+  """
+  batches = [files[k:k + batch_size] for k in range(0, len(files), batch_size)]
+
+  # the decoding threads are shared by all batches
+  with ThreadPoolExecutor(max(1, workers)) as pool:
+    if not prefetch:
+      for batch in batches:
+        yield batch, load_batch(batch, directory, extension, workers, load, pool)
+      return
+
+    with ThreadPoolExecutor(1) as prefetcher:
+      future = None
+      for k, batch in enumerate(batches):
+        if future is None:
+          future = prefetcher.submit(load_batch, batch, directory, extension, workers, load, pool)
+        result = future.result()
+        future = None
+        if k + 1 < len(batches):
+          future = prefetcher.submit(load_batch, batches[k + 1], directory, extension, workers, load, pool)
+        yield batch, result
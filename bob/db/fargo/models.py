@@ -3,7 +3,7 @@
 
 import os
 
-from sqlalchemy import Table, Column, Integer, String, ForeignKey
+from sqlalchemy import Table, Column, Integer, String, ForeignKey, Index
 from bob.db.base.sqlalchemy_migration import Enum, relationship
 from sqlalchemy.orm import backref
 from sqlalchemy.ext.declarative import declarative_base
@@ -18,7 +18,9 @@ Base = declarative_base()
 # association table between File and ProtocolPurpose
 protocolPurpose_file_association = Table('protocolPurpose_file_association', Base.metadata,
   Column('protocolPurpose_id', Integer, ForeignKey('protocolPurpose.id')),
-  Column('file_id',  Integer, ForeignKey('file.id')))
+  Column('file_id',  Integer, ForeignKey('file.id')),
+  Index('ix_protocolPurpose_file', 'protocolPurpose_id', 'file_id'),
+  Index('ix_file_protocolPurpose', 'file_id', 'protocolPurpose_id'))
 
 class Client(Base):
   """Database clients.
@@ -35,6 +37,9 @@ class Client(Base):
   """
   
   __tablename__ = 'client'
+  __table_args__ = (
+    Index('ix_client_group', 'group'),
+  )
   id = Column(Integer, primary_key=True)
   group_choices = ('world', 'dev', 'eval')
   group = Column(Enum(*group_choices))
@@ -82,6 +87,10 @@ class File(Base, bob.db.base.File):
   """
 
   __tablename__ = 'file'
+  __table_args__ = (
+    Index('ix_file_client_modality', 'client_id', 'modality'),
+    Index('ix_file_conditions', 'light', 'pose', 'recording', 'modality'),
+  )
 
   # key id for files
   id = Column(Integer, primary_key=True)
@@ -222,6 +231,9 @@ class ProtocolPurpose(Base):
   """
 
   __tablename__ = 'protocolPurpose'
+  __table_args__ = (
+    Index('ix_protocolPurpose_protocol', 'protocol_id', 'group', 'purpose'),
+  )
 
   id = Column(Integer, primary_key=True)
   
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Packed image containers, with zero-copy access to each image
+
+The images of each modality are decoded once and stored in a single
+``<modality>.npy`` array, next to a ``<modality>.ids.npy`` array holding
+the sorted file ids: the image of a file is at the position of its id.
+"""
+
+import os
+import numpy
+
+from .loader import iter_batches
+
+
+def pack_images(files, directory, extension, output, workers=4, batch_size=256, load=None):
+  """Decodes images once, and stores them in one array per modality
+
+  Parameters
+  ----------
+  files: list
+    The files, with ``id``, ``modality`` and ``make_path``
+  directory: str
+    The directory containing the images
+  extension: str
+    The extension of the images
+  output: str
+    The directory where the packed arrays are written
+  workers: int
+    The number of decoding threads
+  batch_size: int
+    The number of images decoded at once
+  load: callable
+    The function decoding a file, :py:func:`bob.io.base.load` by default
+
+  Returns
+  -------
+  dict:
+    The number of packed images per modality
+
+  """
+  if not os.path.exists(output):
+    os.makedirs(output)
+
+  modalities = {}
+  for f in files:
+    modalities.setdefault(f.modality, []).append(f)
+
+  retval = {}
+  for modality, mfiles in sorted(modalities.items()):
+    mfiles = sorted(mfiles, key=lambda f: f.id)
+    packed = None
+    offset = 0
+    for batch, images in iter_batches(mfiles, batch_size, directory, extension, workers, load=load):
+      images = images[modality]
+      if packed is None:
+        packed = numpy.lib.format.open_memmap(os.path.join(output, '%s.npy' % modality), mode='w+',
+            dtype=images.dtype, shape=(len(mfiles),) + images.shape[1:])
+      if images.shape[1:] != packed.shape[1:]:
+        raise ValueError("Images of modality '%s' do not all have the same shape" % modality)
+      packed[offset:offset + len(images)] = images
+      offset += len(images)
+    packed.flush()
+    del packed
+    numpy.save(os.path.join(output, '%s.ids.npy' % modality), numpy.array([f.id for f in mfiles], dtype=numpy.int64))
+    retval[modality] = len(mfiles)
+  return retval
+
+
+class PackedImages(object):
+  """Zero-copy access to packed images
+
+  The arrays are memory mapped: accessing an image returns a view, and
+  only the pages actually read are loaded from disk.
+
+  Attributes
+  ----------
+  directory: str
+    The directory containing the packed arrays
+  modalities: list of str
+    The packed modalities
+
+  """
+
+  def __init__(self, directory):
+    """ Init function
+
+    Parameters
+    ----------
+    directory: str
+      The directory written by :py:func:`pack_images`
+
+    """
+    self.directory = directory
+    self.modalities = sorted(f[:-len('.ids.npy')] for f in os.listdir(directory) if f.endswith('.ids.npy'))
+    self._ids = {}
+    self._arrays = {}
+
+  def _open(self, modality):
+    if modality not in self._arrays:
+      if modality not in self.modalities:
+        raise KeyError("No image of modality '%s' is packed in '%s'" % (modality, self.directory))
+      self._ids[modality] = numpy.load(os.path.join(self.directory, '%s.ids.npy' % modality))
+      self._arrays[modality] = numpy.load(os.path.join(self.directory, '%s.npy' % modality), mmap_mode='r')
+    return self._ids[modality], self._arrays[modality]
+
+  def array(self, modality):
+    """Returns all packed images of a modality
+
+    Parameters
+    ----------
+    modality: str
+      The modality
+
+    Returns
+    -------
+    tuple:
+      The sorted file ids, and the memory-mapped images in the same order
+
+    """
+    return self._open(modality)
+
+  def offsets(self, files):
+    """Returns the positions of files in the array of their modality
+
+    Parameters
+    ----------
+    files: list
+      The files, which must all have the same modality
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      The positions of the files
+
+    Raises
+    ------
+    KeyError:
+      if a file was not packed
+
+    """
+    files = list(files)
+    if not files:
+      return numpy.array([], dtype=numpy.int64)
+    ids, _ = self._open(files[0].modality)
+    wanted = numpy.array([f.id for f in files], dtype=numpy.int64)
+    retval = numpy.searchsorted(ids, wanted)
+    missing = (retval >= len(ids)) | (ids[numpy.minimum(retval, len(ids) - 1)] != wanted)
+    if missing.any():
+      raise KeyError("File(s) %s were not packed in '%s'" % (wanted[missing].tolist(), self.directory))
+    return retval
+
+  def __getitem__(self, f):
+    """Returns the image of a file, as a read-only view"""
+    _, array = self._open(f.modality)
+    return array[self.offsets([f])[0]]
+
+  def load(self, files):
+    """Returns the images of several files of the same modality
+
+    Parameters
+    ----------
+    files: list
+      The files
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      The images, stacked. This is a copy, unless the files are
+      consecutive in the packed array, in which case a view is returned.
+
+    """
+    files = list(files)
+    offsets = self.offsets(files)
+    _, array = self._open(files[0].modality) if files else (None, numpy.empty((0,)))
+    if len(offsets) and (numpy.diff(offsets) == 1).all():
+      return array[offsets[0]:offsets[-1] + 1]
+    return array[offsets]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Declarative definition of the FARGO protocols
+
+Each protocol is defined by the filters selecting the files of its
+training, enrollment and probe sets. A filter maps a column of
+:py:class:`bob.db.fargo.models.File` to its accepted values. The training
+set always comes from the 'world' group, while the enrollment and probe
+sets are defined in both the 'dev' and 'eval' groups.
+
+Each (protocol, group, purpose) is compiled into a single
+``INSERT INTO protocolPurpose_file_association SELECT ...`` statement.
+"""
+
+import collections
+
+
+# the (group, purpose) of each protocol
+GROUP_PURPOSES = (('world', 'train'), ('dev', 'enroll'), ('dev', 'probe'), ('eval', 'enroll'), ('eval', 'probe'))
+
+# training is always done with controlled frontal images
+TRAIN = {'light': ('controlled',), 'pose': ('frontal',)}
+
+# enrollment is done with controlled frontal images, of the first recording of each device
+ENROLL = {'light': ('controlled',), 'pose': ('frontal',), 'recording': ('0',)}
+
+# the probes of each scenario
+PROBES = collections.OrderedDict([
+  # matched controlled -> probes are controlled
+  ('mc', {'light': ('controlled',), 'pose': ('frontal',), 'recording': ('1',)}),
+  # unmatched degraded -> probes are dark
+  ('ud', {'light': ('dark',), 'pose': ('frontal',), 'recording': ('0', '1')}),
+  # unmatched outdoor -> probes are outdoor
+  ('uo', {'light': ('outdoor',), 'pose': ('frontal',), 'recording': ('0', '1')}),
+  # unmatched pose -> probes with varying yaw
+  ('pos-yaw', {'light': ('controlled',), 'pose': ('yaw',), 'recording': ('0', '1')}),
+  # unmatched pose -> probes with varying pitch
+  ('pos-pitch', {'light': ('controlled',), 'pose': ('pitch',), 'recording': ('0', '1')}),
+])
+
+
+def _protocol(train, enroll, probe, probes):
+  """Returns the filters of each purpose of a protocol
+
+  Parameters
+  ----------
+  train: tuple of str
+    The modalities of the training set
+  enroll: str
+    The modality of the enrollment set
+  probe: str
+    The modality of the probe set
+  probes: dict
+    The filters of the probe set, without the modality
+
+  """
+  return {
+    'train': dict(TRAIN, modality=train),
+    'enroll': dict(ENROLL, modality=(enroll,)),
+    'probe': dict(probes, modality=(probe,)),
+  }
+
+
+PROTOCOLS = collections.OrderedDict()
+for _scenario in ('mc', 'ud', 'uo'):
+  # frontal face verification: {mc, ud, uo}-{rgb, nir, depth}
+  for _modality in ('rgb', 'nir', 'depth'):
+    PROTOCOLS['%s-%s' % (_scenario, _modality)] = _protocol((_modality,), _modality, _modality, PROBES[_scenario])
+  # heterogeneous face verification: training with RGB and the target modality,
+  # RGB enrollment, and probes of the target modality: {mc, ud, uo}-rgb2{nir, depth}
+  for _modality in ('nir', 'depth'):
+    PROTOCOLS['%s-rgb2%s' % (_scenario, _modality)] = _protocol(('rgb', _modality), 'rgb', _modality, PROBES[_scenario])
+# pose-varying face verification
+for _scenario in ('pos-yaw', 'pos-pitch'):
+  PROTOCOLS[_scenario] = _protocol(('rgb',), 'rgb', 'rgb', PROBES[_scenario])
+
+
+def compile_purpose(purpose_id, group, filters, client_ids=None):
+  """Compiles the files of a protocol purpose into a set-based insertion
+
+  Parameters
+  ----------
+  purpose_id: int
+    The id of the :py:class:`bob.db.fargo.models.ProtocolPurpose`
+  group: str
+    The group of the clients ('world', 'dev' or 'eval')
+  filters: dict
+    The accepted values of each file column
+  client_ids: list of int
+    If given, only the files of these clients are inserted
+
+  Returns
+  -------
+  :py:class:`sqlalchemy.sql.expression.Insert`:
+    The ``INSERT INTO protocolPurpose_file_association SELECT ...`` statement
+
+  """
+  from sqlalchemy import select, literal, and_
+  from .models import File, Client, protocolPurpose_file_association
+
+  conditions = [File.client_id.in_(select([Client.id]).where(Client.group == group))]
+  for column in sorted(filters):
+    conditions.append(getattr(File, column).in_(filters[column]))
+  if client_ids is not None:
+    conditions.append(File.client_id.in_(client_ids))
+
+  selection = select([literal(purpose_id), File.id]).where(and_(*conditions)).order_by(File.id)
+  return protocolPurpose_file_association.insert().from_select(['protocolPurpose_id', 'file_id'], selection)
@@ -2,15 +2,27 @@
 # encoding: utf-8
 
 import os
+import threading
 from bob.db.base import utils
-from .models import *
 
-from .driver import Interface
-INFO = Interface()
-SQLITE_FILE = INFO.files()[0]
+from .utils import database_file
 
 import bob.db.base
 
+
+def __getattr__(name):
+  # resolved on first access, to keep the import of this module light
+  if name == 'SQLITE_FILE':
+    return database_file()
+  if name == 'INFO':
+    from .driver import Interface
+    return Interface()
+  from . import models
+  if not name.startswith('_') and hasattr(models, name):
+    return getattr(models, name)
+  raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+
 class Database(bob.db.base.SQLiteDatabase):
   """ Class representing the database
 
@@ -26,6 +38,20 @@ class Database(bob.db.base.SQLiteDatabase):
     Path where the annotations are stored
   annotation_extension: str
     Extension of anootation files
+  annotation_type: str
+    Type of the annotation files, see :py:func:`bob.db.base.read_annotation_file`
+  use_index: bool
+    If set, queries are answered from an in-memory index of the protocols
+  cache_size: int
+    The maximum number of query results kept in memory
+  threadsafe: bool
+    If set, the database is opened read-only with one session per thread
+  async_workers: int
+    The number of threads decoding images for :py:meth:`aiter_images`
+
+  Instances can be pickled, and used in a forked process: the connection
+  to the database is then re-opened on first use, while the in-memory
+  index and the plain-data cached results are kept.
 
   """
 
@@ -34,7 +60,14 @@ class Database(bob.db.base.SQLiteDatabase):
                original_extension=None,
                annotation_directory=None,
                annotation_extension=None,
-               protocol='mc-rgb'):
+               protocol='mc-rgb',
+               annotation_type='json',
+               use_index=False,
+               cache_size=128,
+               threadsafe=False,
+               pool_size=4,
+               async_workers=4,
+               sqlite_file=None):
     """ Init function
 
     Parameters
@@ -47,12 +80,307 @@ class Database(bob.db.base.SQLiteDatabase):
       Path where the annotations are stored
     annotation_extension: str
       Extension of anootation files
+    annotation_type: str
+      Type of the annotation files, see :py:func:`bob.db.base.read_annotation_file`
+    use_index: bool
+      If set, the association table is loaded once in memory (on first use),
+      and :py:meth:`objects`, :py:meth:`clients` and :py:meth:`model_ids`
+      are then answered without any SQL query.
+    cache_size: int
+      The maximum number of results of :py:meth:`objects`, :py:meth:`clients`
+      and :py:meth:`protocol_names` kept in a least-recently-used cache.
+      The cache is cleared whenever the database file changes. Set to 0 to
+      disable caching.
+    threadsafe: bool
+      If set, ``db.sql3`` is opened as an immutable, read-only SQLite
+      database, through a pool of connections and a
+      :py:func:`sqlalchemy.orm.scoped_session`: each thread transparently
+      gets its own session, so that a single instance can be queried
+      concurrently by many threads. The returned objects are detached
+      from the sessions, with the client of each file loaded.
+    pool_size: int
+      The number of connections kept open in threadsafe mode
+    async_workers: int
+      The number of threads decoding images for :py:meth:`aiter_images`.
+      Queries of :py:meth:`aobjects` run in ``pool_size`` threads, and
+      require the threadsafe mode. The threads are stopped by
+      :py:meth:`close`.
+    sqlite_file: str
+      The SQLite database file, the installed ``db.sql3`` by default
 
     """
-    super(Database, self).__init__(SQLITE_FILE, File, original_directory, original_extension)
+    # the connection is only opened by the first query, see _open_session()
+    bob.db.base.Database.__init__(self, original_directory, original_extension)
+    self.m_sqlite_file = sqlite_file or database_file()
+    self.m_session = None
     self.annotation_directory = annotation_directory
     self.annotation_extension = annotation_extension
+    self.annotation_type = annotation_type
+    self._annotations = None
+    self._annotation_cache = {}
     self.protocol = protocol
+    self.use_index = use_index
+    self._index = None
+    self._files = None
+    self._clients = None
+    self._table = None
+    self._lock = threading.RLock()
+    self._pid = os.getpid()
+    self.threadsafe = threadsafe
+    self.pool_size = pool_size
+    self.async_workers = async_workers
+    self._executors = {}
+    self._cache = None
+    if cache_size:
+      from .cache import QueryCache
+      self._cache = QueryCache(cache_size, self.m_sqlite_file)
+
+  @property
+  def m_file_class(self):
+    from .models import File
+    return File
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state.update(self._detached_state())
+    del state['_lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.RLock()
+    self._pid = os.getpid()
+
+  def _detached_state(self):
+    """Returns the attributes to reset when leaving the current connection
+
+    SQLAlchemy objects are bound to the session of this process, so
+    they are dropped together with the session, while the plain data
+    (protocol index, file table and protocol names) is kept.
+
+    """
+    cache = self._cache
+    if cache is not None:
+      cache = cache.copy(lambda key, value: key[0] == 'protocol_names' or (key[0] == 'objects' and key[-1]))
+    return {'m_session': None, '_files': None, '_clients': None, '_cache': cache, '_annotations': None, '_executors': {}}
+
+  def _check_fork(self):
+    """Drops the connection inherited from the parent after a fork"""
+    if os.getpid() != self._pid:
+      # the session of the parent is not closed, since the parent still uses it
+      self.__dict__.update(self._detached_state())
+      self._lock = threading.RLock()
+      self._pid = os.getpid()
+
+  def _open_session(self):
+    """Opens the session to the database, if needed"""
+    self._check_fork()
+    if self.m_session is None and os.path.exists(self.m_sqlite_file):
+      with self._lock:
+        if self.m_session is None:
+          if self.threadsafe:
+            self.m_session = self._pooled_session(self.pool_size)
+          else:
+            self.m_session = utils.session_try_readonly('sqlite', self.m_sqlite_file)
+
+  def is_valid(self):
+    """Returns if a connection to the database can be established
+
+    This does not open the connection, which is only opened by the first
+    query.
+
+    """
+    return os.path.exists(self.m_sqlite_file)
+
+  def __del__(self):
+    for executor in self.__dict__.get('_executors', {}).values():
+      executor.shutdown(wait=False)
+    # only closes a session actually opened by this process
+    session = self.__dict__.get('m_session')
+    if session is not None and self.__dict__.get('_pid') == os.getpid():
+      session.close()
+
+  def query(self, *args):
+    """Creates a query, re-opening the connection if needed
+
+    See :py:meth:`bob.db.base.SQLiteDatabase.query`
+
+    """
+    self._open_session()
+    return super(Database, self).query(*args)
+
+  def _pooled_session(self, pool_size):
+    """Creates a thread-local session on a read-only connection pool
+
+    Parameters
+    ----------
+    pool_size: int
+      The number of connections kept open in the pool
+
+    Returns
+    -------
+    :py:class:`sqlalchemy.orm.scoped_session`:
+      The session registry, which can be used as a session
+
+    """
+    import sqlite3
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker, scoped_session
+    from sqlalchemy.pool import QueuePool
+    from urllib.request import pathname2url
+
+    uri = 'file:%s?mode=ro&immutable=1' % pathname2url(os.path.abspath(self.m_sqlite_file))
+    connect = lambda: sqlite3.connect(uri, uri=True, check_same_thread=False)
+    # no overflow limit: each thread keeps its connection while its session is open
+    engine = create_engine('sqlite://', creator=connect, poolclass=QueuePool, pool_size=pool_size, max_overflow=-1)
+    return scoped_session(sessionmaker(bind=engine, autoflush=False))
+
+  def _detach(self, objects):
+    """Detaches loaded objects from the session of the current thread
+
+    In threadsafe mode, each thread has its own session, while cached
+    results and the objects of the index are shared by all threads. The
+    objects are therefore detached from the session which loaded them,
+    once the client of each file is loaded: no thread then ever goes
+    through the session of another one. The other relationships (such as
+    ``File.protocolPurposes``) cannot be loaded from detached objects.
+
+    Parameters
+    ----------
+    objects: list
+      The loaded :py:class:`bob.db.fargo.models.File` or
+      :py:class:`bob.db.fargo.models.Client` objects
+
+    Returns
+    -------
+    lst:
+      The same objects
+
+    """
+    if self.threadsafe and self.m_session is not None:
+      from .models import File
+      session = self.m_session()
+      clients = set(o.client for o in objects if isinstance(o, File))
+      for o in list(objects) + list(clients):
+        if o in session:
+          session.expunge(o)
+    return objects
+
+  def _cached(self, key, function, *args):
+    """Returns the cached result of a query, running it if needed
+
+    Parameters
+    ----------
+    key: tuple
+      The normalized arguments of the query
+    function: callable
+      The function computing the result from ``args``
+
+    """
+    self._check_fork()
+    if self._cache is None:
+      return function(*args)
+    if self._cache.validate():
+      # the database file changed: drop everything derived from it
+      with self._lock:
+        self._index = self._files = self._clients = self._table = None
+    found, value = self._cache.get(key)
+    if not found:
+      value = function(*args)
+      self._cache.put(key, value)
+    # lists are copied, so that callers can safely modify them
+    return list(value) if isinstance(value, list) else value
+
+  def cache_info(self):
+    """Returns the counters of the query result cache
+
+    Returns
+    -------
+    dict:
+      The number of hits, misses and evictions, the current number of
+      cached results and the capacity of the cache.
+
+    """
+    if self._cache is None:
+      return {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'capacity': 0}
+    return self._cache.info()
+
+  def _association_rows(self, protocols=None):
+    """Returns a query over the association table
+
+    Parameters
+    ----------
+    protocols: tuple of str
+      The protocols to retrieve. If None, all protocols are retrieved.
+
+    Returns
+    -------
+    :py:class:`sqlalchemy.orm.query.Query`:
+      The query, returning (protocol, group, purpose, file_id) rows
+
+    """
+    from .models import Protocol, ProtocolPurpose, protocolPurpose_file_association
+
+    q = self.query(Protocol.name, ProtocolPurpose.group, ProtocolPurpose.purpose, protocolPurpose_file_association.c.file_id).\
+        select_from(Protocol).\
+        join(ProtocolPurpose, ProtocolPurpose.protocol_id == Protocol.id).\
+        join(protocolPurpose_file_association, protocolPurpose_file_association.c.protocolPurpose_id == ProtocolPurpose.id)
+    if protocols is not None:
+      q = q.filter(Protocol.name.in_(protocols))
+    return q
+
+  def _scan_protocols(self, protocols=None):
+    """Loads the association table of some protocols in a single pass
+
+    Parameters
+    ----------
+    protocols: tuple of str
+      The protocols to load. If None, all protocols and all files and
+      clients of the database are loaded.
+
+    Returns
+    -------
+    tuple:
+      The :py:class:`bob.db.fargo.index.ProtocolIndex`, and a dictionary
+      of the loaded files, indexed by file id.
+
+    """
+    from .models import File, Client, Protocol, ProtocolPurpose
+    from .index import ProtocolIndex
+
+    associations = self._association_rows(protocols)
+    if protocols is None:
+      files = self.query(File).all()
+      clients = [(c.id, c.group) for c in self.query(Client)]
+      protocols = [k.name for k in self.query(Protocol)]
+    else:
+      files = self.query(File).join((ProtocolPurpose, File.protocolPurposes)).join(Protocol).\
+          filter(Protocol.name.in_(protocols)).distinct().all()
+      clients = []
+
+    index = ProtocolIndex(associations, [(f.id, f.client_id, f.modality) for f in files], clients, protocols)
+    return index, dict((f.id, f) for f in files)
+
+  def _protocol_index(self):
+    """Returns the in-memory protocol index, loading it on first use
+
+    The file and client objects are loaded once as well, so that
+    the index can directly return them.
+
+    """
+    from .models import File, Client
+    self._check_fork()
+    with self._lock:
+      if self._index is None:
+        index, files = self._scan_protocols()
+        self._files = dict((f.id, f) for f in self._detach(list(files.values())))
+        self._clients = dict((c.id, c) for c in self._detach(self.query(Client).all()))
+        self._index = index
+      elif self._files is None:
+        # the index was inherited (pickled or forked), only reload the objects
+        self._files = dict((f.id, f) for f in self._detach(self.query(File).all()))
+        self._clients = dict((c.id, c) for c in self._detach(self.query(Client).all()))
+      return self._index
 
   @property
   def modalities(self):
@@ -66,7 +394,8 @@ class Database(bob.db.base.SQLiteDatabase):
     protocol: str
       ignored, since the group are the same across protocols.
     
-    """   
+    """
+    from .models import ProtocolPurpose
     return ProtocolPurpose.group_choices
 
 
@@ -86,7 +415,17 @@ class Database(bob.db.base.SQLiteDatabase):
     
     """
 
-    groups = self.check_parameters_for_validity(groups, "group", self.groups())
+    groups = tuple(self.check_parameters_for_validity(groups, "group", self.groups()))
+    return self._cached(('clients', groups), self._query_clients, groups)
+
+
+  def _query_clients(self, groups):
+    """Returns the clients of the given (checked) groups"""
+    from .models import Client
+    if self.use_index:
+      index = self._protocol_index()
+      return [self._clients[k] for k in index.client_ids(groups)]
+
     retval = []
     if "world" in groups:
       q = self.query(Client).filter(Client.group == 'world')
@@ -97,7 +436,7 @@ class Database(bob.db.base.SQLiteDatabase):
     if 'eval' in groups:
       q = self.query(Client).filter(Client.group == 'eval')
       retval += list(q)
-    return retval
+    return self._detach(retval)
 
 
   def models(self, protocol=None, groups=None):
@@ -151,6 +490,7 @@ class Database(bob.db.base.SQLiteDatabase):
       if the client does not exist.
     
     """
+    from .models import Client
     return self.query(Client).filter(Client.id == id).one()
  
 
@@ -158,6 +498,13 @@ class Database(bob.db.base.SQLiteDatabase):
     """Returns all registered protocol names
     
     """
+    return self._cached(('protocol_names',), self._query_protocol_names)
+
+
+  def _query_protocol_names(self):
+    """Returns all registered protocol names, without caching"""
+    if self.use_index:
+      return list(self._protocol_index().protocols)
     l = self.protocols()
     retval = [str(k.name) for k in l]
     return retval
@@ -167,6 +514,7 @@ class Database(bob.db.base.SQLiteDatabase):
     """Returns all registered protocols
     
     """
+    from .models import Protocol
     return list(self.query(Protocol))
 
   
@@ -174,10 +522,97 @@ class Database(bob.db.base.SQLiteDatabase):
     """Returns purposes 
     
     """
+    from .models import ProtocolPurpose
     return ProtocolPurpose.purpose_choices
 
 
-  def objects(self, protocol=None, purposes=None, model_ids=None, groups=None, modality=None):
+  def _check_objects_parameters(self, protocol, purposes, model_ids, groups, modality, protocol_names=None):
+    """Checks and normalizes the parameters of :py:meth:`objects`
+
+    The valid protocol names may be given to avoid querying them again.
+
+    Returns
+    -------
+    tuple:
+      The protocols, purposes, model ids, groups and modalities, as tuples
+
+    """
+    if protocol_names is None:
+      protocol_names = self.protocol_names()
+    protocol = self.check_parameters_for_validity(protocol, "protocol", protocol_names)
+    purposes = self.check_parameters_for_validity(purposes, "purpose", self.purposes())
+    groups = self.check_parameters_for_validity(groups, "group", self.groups())
+    modality = self.check_parameters_for_validity(modality, "modality", self.modalities)
+
+    from collections.abc import Iterable
+    if(model_ids is None):
+      model_ids = ()
+    elif(not isinstance(model_ids, Iterable)):
+      model_ids = (model_ids,)
+
+    return tuple(protocol), tuple(purposes), tuple(model_ids), tuple(groups), tuple(modality)
+
+
+  def _objects_query(self, entities, protocol, purposes, model_ids, groups, modality):
+    """Builds a single query returning the files of :py:meth:`objects`
+
+    The enroll, probe and world selections are merged in one
+    ``DISTINCT ... ORDER BY File.id`` statement. All parameters must
+    already have been checked for validity.
+
+    Parameters
+    ----------
+    entities: tuple
+      The mapped classes or columns to retrieve
+
+    Returns
+    -------
+    :py:class:`sqlalchemy.orm.query.Query` or None:
+      The query, or None if nothing can match the given parameters.
+
+    """
+    from .models import File, Client, Protocol, ProtocolPurpose
+    from sqlalchemy import and_, or_
+
+    clauses = []
+    if 'world' in groups:
+      c = [Client.group == 'world', ProtocolPurpose.group == 'world', File.modality.in_(modality)]
+      if model_ids:
+        c.append(Client.id.in_(model_ids))
+      clauses.append(and_(*c))
+
+    if ('dev' in groups or 'eval' in groups):
+
+      if('enroll' in purposes):
+        c = [ProtocolPurpose.group.in_(groups), ProtocolPurpose.purpose == 'enroll']
+        if model_ids:
+          c.append(Client.id.in_(model_ids))
+        clauses.append(and_(*c))
+
+      # dense probing -> don't filter by model_ids
+      if('probe' in purposes):
+        clauses.append(and_(ProtocolPurpose.group.in_(groups), ProtocolPurpose.purpose == 'probe'))
+
+    if not clauses:
+      return None
+
+    q = self.query(*entities).select_from(File).join(Client).join((ProtocolPurpose, File.protocolPurposes)).join(Protocol)
+    q = q.filter(Protocol.name.in_(protocol)).filter(or_(*clauses))
+    return q.distinct().order_by(File.id)
+
+
+  def _file_table(self):
+    """Returns a table of all files sorted by id, used with the index"""
+    with self._lock:
+      if self._table is None:
+        from .table import FileTable
+        self._protocol_index()
+        self._table = FileTable.from_rows((f.id, f.client_id, f.light, f.device, f.recording, f.modality, f.pose, f.path)
+            for f in sorted(self._files.values()))
+      return self._table
+
+
+  def objects(self, protocol=None, purposes=None, model_ids=None, groups=None, modality=None, as_table=False):
     """Returns a set of Files for the specific query by the user.
 
     Parameters
@@ -198,6 +633,9 @@ class Database(bob.db.base.SQLiteDatabase):
       tuple with all possible values.
     modality: str or tuple
       One of the three modalities 'rgb', 'nir' and 'depth'
+    as_table: bool
+      If set, a compact :py:class:`bob.db.fargo.table.FileTable` is returned
+      instead of a list of :py:class:`bob.db.fargo.models.File`.
 
     Returns
     -------
@@ -205,48 +643,516 @@ class Database(bob.db.base.SQLiteDatabase):
       A list of files which have the given properties.
     
     """
-    from sqlalchemy import and_
-    protocol = self.check_parameters_for_validity(protocol, "protocol", self.protocol_names())
-    purposes = self.check_parameters_for_validity(purposes, "purpose", self.purposes())
-    groups = self.check_parameters_for_validity(groups, "group", self.groups())
-    modality = self.check_parameters_for_validity(modality, "modality", self.modalities)
+    protocol, purposes, model_ids, groups, modality = self._check_objects_parameters(protocol, purposes, model_ids, groups, modality)
+    return self._cached(('objects', protocol, purposes, model_ids, groups, modality, as_table),
+        self._query_objects, protocol, purposes, model_ids, groups, modality, as_table)
 
-    import collections
-    if(model_ids is None):
-      model_ids = ()
-    elif(not isinstance(model_ids, collections.Iterable)):
-      model_ids = (model_ids,)
+
+  def _query_objects(self, protocol, purposes, model_ids, groups, modality, as_table):
+    """Returns the files for the given (checked) parameters of :py:meth:`objects`"""
+    from .models import File
+    if self.use_index:
+      index = self._protocol_index()
+      ids = index.lookup(protocol, purposes, model_ids, groups, modality)
+      if as_table:
+        table = self._file_table()
+        return table[table.positions(ids)]
+      return [self._files[k] for k in ids.tolist()]
+
+    if as_table:
+      from .table import FileTable
+      q = self._objects_query((File.id, File.client_id, File.light, File.device, File.recording, File.modality, File.pose, File.path),
+          protocol, purposes, model_ids, groups, modality)
+      return FileTable.from_rows(q if q is not None else [])
 
     # Now query the database
-    retval = []
-    if 'world' in groups:
-      q = self.query(File).join(Client).join((ProtocolPurpose, File.protocolPurposes)).join(Protocol)
-      q = q.filter(Client.group == 'world').filter(and_(Protocol.name.in_(protocol), ProtocolPurpose.group == 'world'))
-      if model_ids:
-        q = q.filter(Client.id.in_(model_ids))
-      q = q.order_by(File.client_id)
-      q = q.filter(File.modality.in_(modality))
+    q = self._objects_query((File,), protocol, purposes, model_ids, groups, modality)
+    if q is None:
+      return []
+    return self._detach(list(q))
 
-      retval += list(q)
 
-    if ('dev' in groups or 'eval' in groups):
+  def objects_many(self, specs):
+    """Returns the Files of several queries at once.
 
-      if('enroll' in purposes):
-        q = self.query(File).join(Client).join((ProtocolPurpose, File.protocolPurposes)).join(Protocol).\
-              filter(and_(Protocol.name.in_(protocol), ProtocolPurpose.group.in_(groups), ProtocolPurpose.purpose == 'enroll'))
-        if model_ids:
-          q = q.filter(Client.id.in_(model_ids))
-        q = q.order_by(File.client_id)
-        retval += list(q)
+    Instead of running :py:meth:`objects` once per query, the association
+    table of all requested protocols is scanned once, and the rows are
+    then distributed to each query.
 
-      # dense probing -> don't filter by model_ids
-      if('probe' in purposes):
-        q = self.query(File).join(Client).join((ProtocolPurpose, File.protocolPurposes)).join(Protocol).\
-              filter(and_(Protocol.name.in_(protocol), ProtocolPurpose.group.in_(groups), ProtocolPurpose.purpose == 'probe'))
-        q = q.order_by(File.client_id)
-        retval += list(q)
-
-    # remove duplicates and sort the list
-    rv = list(set(retval))
-    rv.sort()
-    return rv
+    Parameters
+    ----------
+    specs: list of dict
+      The queries, each one being a dictionary with (some of) the keyword
+      arguments of :py:meth:`objects`: ``protocol``, ``purposes``,
+      ``model_ids``, ``groups`` and ``modality``.
+
+    Returns
+    -------
+    lst:
+      A list containing, for each query, the list of files which have the
+      given properties.
+
+    """
+    protocol_names = self.protocol_names()
+    specs = [self._check_objects_parameters(s.get('protocol'), s.get('purposes'), s.get('model_ids'), s.get('groups'), s.get('modality'), protocol_names)
+        for s in specs]
+
+    if self.use_index:
+      index, files = self._protocol_index(), self._files
+    else:
+      protocols = sorted(set(p for s in specs for p in s[0]))
+      index, files = self._scan_protocols(protocols)
+      self._detach(list(files.values()))
+
+    return [[files[k] for k in index.lookup(*s).tolist()] for s in specs]
+
+
+  def comparison_pairs(self, protocol, group):
+    """Returns all model/probe comparisons of a group as NumPy arrays
+
+    The dev and eval groups use dense probing: each model is compared to
+    every probe. Scores can then be stored in a preallocated matrix:
+
+    .. code-block:: python
+
+      pairs = db.comparison_pairs('mc-rgb', 'dev')
+      scores = numpy.empty((len(pairs.model_ids), len(pairs.probe_ids)))
+      scores[pairs.model_index, pairs.probe_index] = ...
+
+    Parameters
+    ----------
+    protocol: str
+      One of the FARGO protocols.
+    group: str
+      One of the groups 'dev' or 'eval'.
+
+    Returns
+    -------
+    :py:class:`bob.db.fargo.index.ComparisonPairs`:
+      The model ids, enrollment and probe file ids, and the indices of each
+      comparison in the score matrix.
+
+    """
+    protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
+    group = self.check_parameter_for_validity(group, "group", ('dev', 'eval'))
+
+    if self.use_index:
+      index = self._protocol_index()
+    else:
+      index = self._scan_protocols((protocol,))[0]
+    return index.comparison_pairs(protocol, group)
+
+
+  def statistics(self, protocol=None, by=('group',)):
+    """Counts the files per condition, with ``GROUP BY`` queries in SQLite.
+
+    Parameters
+    ----------
+    protocol: str or tuple of str
+      If given, the files of the protocol purposes are counted (a file
+      being counted once per purpose it belongs to), and the 'protocol' and
+      'purpose' keys can be used. If None, all files of the database are
+      counted, and the group is the one of their client.
+    by: str or tuple of str
+      The keys to count the files by, among 'protocol', 'group', 'purpose',
+      'client', 'modality', 'light', 'device', 'recording' and 'pose'.
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      A structured array with one field per key, plus a 'count' field,
+      sorted by keys.
+
+    Raises
+    ------
+    ValueError:
+      if a key is unknown, or requires a protocol
+
+    """
+    import numpy
+    from sqlalchemy import func
+    from .models import File, Client, Protocol, ProtocolPurpose
+
+    if isinstance(by, str):
+      by = (by,)
+    columns = {
+      'client': File.client_id,
+      'modality': File.modality,
+      'light': File.light,
+      'device': File.device,
+      'recording': File.recording,
+      'pose': File.pose,
+    }
+    if protocol is None:
+      columns['group'] = Client.group
+    else:
+      protocol = self.check_parameters_for_validity(protocol, "protocol", self.protocol_names())
+      columns['protocol'] = Protocol.name
+      columns['group'] = ProtocolPurpose.group
+      columns['purpose'] = ProtocolPurpose.purpose
+    for key in by:
+      if key not in columns:
+        raise ValueError("Cannot count files by '%s'%s, valid keys are %s" % \
+            (key, '' if protocol else ' without a protocol', sorted(columns)))
+
+    selected = [columns[key] for key in by]
+    q = self.query(*(selected + [func.count(File.id)])).select_from(File)
+    if protocol is None:
+      q = q.join(Client)
+    else:
+      q = q.join((ProtocolPurpose, File.protocolPurposes)).join(Protocol).filter(Protocol.name.in_(protocol))
+    rows = [tuple(row) for row in q.group_by(*selected).order_by(*selected)]
+
+    dtype = []
+    for k, key in enumerate(by):
+      if key == 'client':
+        dtype.append((key, numpy.int64))
+      else:
+        dtype.append((key, 'U%d' % max([len(str(r[k])) for r in rows] + [1])))
+    dtype.append(('count', numpy.int64))
+    return numpy.array(rows, dtype=dtype)
+
+
+  def _annotation_store(self):
+    """Returns the consolidated annotations, if they have been packed"""
+    from .annotations import AnnotationStore, PACKED_ANNOTATIONS
+    if self._annotations is None and self.annotation_directory:
+      filename = os.path.join(self.annotation_directory, PACKED_ANNOTATIONS)
+      if os.path.exists(filename):
+        self._annotations = AnnotationStore(filename)
+    return self._annotations
+
+
+  def pack_annotations(self, files=None):
+    """Consolidates all annotation files into a single memory-mapped array
+
+    This only needs to be done once: afterwards, :py:meth:`annotations`
+    reads the annotations of many files with a single slice of the array.
+
+    Parameters
+    ----------
+    files: list of :py:class:`bob.db.fargo.models.File`
+      The files to pack. If None, all files of the database are packed.
+
+    Returns
+    -------
+    int:
+      The number of files with annotations
+
+    Raises
+    ------
+    ValueError:
+      if no ``annotation_directory`` was given
+
+    """
+    from .annotations import pack_annotations, PACKED_ANNOTATIONS
+    if not self.annotation_directory:
+      raise ValueError("Annotations can only be packed when an annotation directory is given")
+    if files is None:
+      files = self.objects()
+    count = pack_annotations(files, self.annotation_directory, self.annotation_extension, self.annotation_type,
+        os.path.join(self.annotation_directory, PACKED_ANNOTATIONS))
+    self._annotations = None
+    self._annotation_cache = {}
+    return count
+
+
+  def annotation_vectors(self, files):
+    """Returns the annotations of several files as an array
+
+    Parameters
+    ----------
+    files: list of :py:class:`bob.db.fargo.models.File` or :py:class:`bob.db.fargo.table.FileTable`
+      The files
+
+    Files which have no annotation in the packed array (because they were
+    not packed, or were added afterwards) are read from their annotation
+    file.
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      One row per file, with the (y, x) coordinates of the points listed
+      in :py:data:`bob.db.fargo.annotations.ANNOTATION_KEYS` (NaN when
+      missing). Other points of the annotation files are not returned.
+
+    """
+    import numpy
+    from .annotations import ANNOTATION_KEYS, read_annotations, to_vector
+
+    store = self._annotation_store()
+    if store is not None:
+      ids = files.id if hasattr(files, 'column') else [f.id for f in files]
+      retval = store.vectors(ids)
+      unknown = numpy.flatnonzero(numpy.isnan(retval).all(axis=1)).tolist()
+    else:
+      retval = numpy.full((len(files), 2 * len(ANNOTATION_KEYS)), numpy.nan, dtype=numpy.float32)
+      unknown = range(len(files))
+    if not self.annotation_directory:
+      return retval
+
+    # each annotation file is read only once
+    for k in unknown:
+      f = files[k]
+      if f.id not in self._annotation_cache:
+        self._annotation_cache[f.id] = to_vector(read_annotations(
+            f.make_path(self.annotation_directory, self.annotation_extension), self.annotation_type))
+      retval[k] = self._annotation_cache[f.id]
+    return retval
+
+
+  def annotations(self, files):
+    """Returns the annotations of one or several files
+
+    Parameters
+    ----------
+    files: :py:class:`bob.db.fargo.models.File` or list of them
+      The file(s)
+
+    Returns
+    -------
+    dict or lst:
+      The annotations of the file, as a dictionary of (y, x) points (or
+      None if the file has no annotations); a list of them if several
+      files are given. Only the points listed in
+      :py:data:`bob.db.fargo.annotations.ANNOTATION_KEYS` are returned.
+
+    """
+    from .annotations import to_dict
+    if hasattr(files, 'make_path'):
+      return to_dict(self.annotation_vectors([files])[0])
+    return [to_dict(v) for v in self.annotation_vectors(files)]
+
+
+  def load_batch(self, files, directory=None, extension=None, workers=4):
+    """Loads the images of several files, stacked per modality
+
+    The images are decoded in a pool of threads, and copied into one
+    preallocated array per modality. The arrays keep the planar layout of
+    :py:func:`bob.io.base.load`: ``(N, H, W)`` for gray and depth images,
+    ``(N, C, H, W)`` for color images, see :py:mod:`bob.db.fargo.loader`.
+
+    Parameters
+    ----------
+    files: list of :py:class:`bob.db.fargo.models.File`
+      The files to load
+    directory: str
+      The directory containing the images, ``original_directory`` by default
+    extension: str
+      The extension of the images, ``original_extension`` by default
+    workers: int
+      The number of decoding threads
+
+    Returns
+    -------
+    dict:
+      For each modality, a :py:class:`numpy.ndarray` with the images of
+      this modality, in the order of ``files``
+
+    """
+    from .loader import load_batch
+    return load_batch(files, directory or self.original_directory, extension or self.original_extension, workers)
+
+
+  def iter_batches(self, files, batch_size, directory=None, extension=None, workers=4, prefetch=True):
+    """Loads the images of several files, batch after batch
+
+    Parameters
+    ----------
+    files: list of :py:class:`bob.db.fargo.models.File`
+      The files to load
+    batch_size: int
+      The number of files per batch
+    directory, extension, workers:
+      See :py:meth:`load_batch`
+    prefetch: bool
+      If set, the next batch is decoded in the background while the current
+      one is processed
+
+    Yields
+    ------
+    tuple:
+      The files of the batch, and their images as returned by
+      :py:meth:`load_batch`
+
+    """
+    from .loader import iter_batches
+    return iter_batches(files, batch_size, directory or self.original_directory, extension or self.original_extension,
+        workers, prefetch)
+
+
+  def open_packed(self, directory):
+    """Opens the images packed with ``bob_dbmanage.py fargo pack``
+
+    Parameters
+    ----------
+    directory: str
+      The directory containing the packed images
+
+    Returns
+    -------
+    :py:class:`bob.db.fargo.packed.PackedImages`:
+      The packed images: ``packed[f]`` returns a read-only, memory-mapped
+      view on the image of the file ``f``, without any decoding.
+
+    """
+    from .packed import PackedImages
+    return PackedImages(directory)
+
+
+  def _executor(self, kind):
+    """Returns the executor running the queries or the image decoding"""
+    with self._lock:
+      if kind not in self._executors:
+        from concurrent.futures import ThreadPoolExecutor
+        if kind == 'query':
+          workers = self.pool_size
+        else:
+          workers = self.async_workers
+        self._executors[kind] = ThreadPoolExecutor(max(1, workers))
+      return self._executors[kind]
+
+
+  def close(self):
+    """Closes the connection to the database, and stops the thread pools
+
+    The connection is opened again by the next query. A database can also
+    be used as a context manager, which is closed on exit.
+
+    """
+    with self._lock:
+      executors, self._executors = self._executors, {}
+      session, self.m_session = self.m_session, None
+    for executor in executors.values():
+      executor.shutdown(wait=True)
+    if session is not None and self._pid == os.getpid():
+      if self.threadsafe:
+        engine = session.get_bind()
+        session.remove()
+        engine.dispose()
+      else:
+        session.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+  async def aobjects(self, *args, **kwargs):
+    """Returns a set of Files for the specific query by the user, asynchronously.
+
+    The query runs on a bounded pool of ``pool_size`` threads, so that it
+    does not block the event loop. Since the query thread and the thread
+    running the event loop must not share a session, the database must be
+    created with ``threadsafe=True``. The arguments are the ones of
+    :py:meth:`objects`.
+
+    Returns
+    -------
+    lst:
+      A list of files which have the given properties.
+
+    Raises
+    ------
+    ValueError:
+      if the database was not created with ``threadsafe=True``
+
+    """
+    import asyncio
+    import functools
+    if not self.threadsafe:
+      raise ValueError("aobjects() requires a Database created with threadsafe=True")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._executor('query'), functools.partial(self.objects, *args, **kwargs))
+
+
+  async def aiter_images(self, files, directory=None, extension=None, max_pending=8, load=None):
+    """Loads the images of several files, asynchronously.
+
+    The images are decoded on a bounded pool of threads (see
+    ``async_workers``), which is shared by all consumers of this database.
+    At most ``max_pending`` images are decoded ahead of the consumer, so
+    that a slow consumer does not accumulate decoded images in memory.
+
+    Parameters
+    ----------
+    files: list of :py:class:`bob.db.fargo.models.File`
+      The files to load
+    directory: str
+      The directory containing the images, ``original_directory`` by default
+    extension: str
+      The extension of the images, ``original_extension`` by default
+    max_pending: int
+      The maximum number of images decoded ahead of the consumer
+    load: callable
+      The function decoding a file, :py:func:`bob.io.base.load` by default
+
+    Yields
+    ------
+    tuple:
+      Each file, and its image, in the order of ``files``
+
+    """
+    import asyncio
+    import collections
+    if load is None:
+      import bob.io.base
+      load = bob.io.base.load
+    directory = directory or self.original_directory
+    extension = extension or self.original_extension
+    loop = asyncio.get_running_loop()
+    executor = self._executor('load')
+
+    pending = collections.deque()
+    try:
+      for f in files:
+        pending.append((f, loop.run_in_executor(executor, load, f.make_path(directory, extension))))
+        if len(pending) >= max(1, max_pending):
+          f, future = pending.popleft()
+          yield f, await future
+      while pending:
+        f, future = pending.popleft()
+        yield f, await future
+    finally:
+      # the consumer stopped early: don't decode images nobody will use
+      for _, future in pending:
+        future.cancel()
+
+
+  def iter_objects(self, protocol=None, purposes=None, model_ids=None, groups=None, modality=None, chunk_size=1000):
+    """Iterates over the Files for the specific query by the user.
+
+    Contrarily to :py:meth:`objects`, the files are not gathered in a list:
+    a single ``DISTINCT ... ORDER BY`` statement is sent to SQLite and
+    the rows are fetched and yielded in chunks. In threadsafe mode, the
+    files are gathered by :py:meth:`objects`, which detaches them from the
+    session of the current thread.
+
+    Parameters
+    ----------
+    protocol, purposes, model_ids, groups, modality:
+      See :py:meth:`objects`
+    chunk_size: int
+      The number of rows fetched at once
+
+    Yields
+    ------
+    :py:class:`bob.db.fargo.models.File`:
+      The files which have the given properties, sorted by id.
+
+    """
+    from .models import File
+    protocol, purposes, model_ids, groups, modality = self._check_objects_parameters(protocol, purposes, model_ids, groups, modality)
+
+    if self.use_index or self.threadsafe:
+      for f in self.objects(protocol, purposes, model_ids, groups, modality):
+        yield f
+      return
+
+    q = self._objects_query((File,), protocol, purposes, model_ids, groups, modality)
+    if q is None:
+      return
+    for f in q.yield_per(chunk_size):
+      yield f
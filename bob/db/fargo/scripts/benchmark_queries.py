@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+
+    Query plan and latency of the FARGO protocol queries (%(version)s)
+
+    This script runs the query of every protocol, group and purpose
+    on a FARGO SQLite file, and records its query plan and latency.
+    To assess a change of the database schema, run it on the database
+    files built before and after the change, and compare both outputs.
+
+
+Usage:
+  %(prog)s [<sqlite_file>]
+           [--repeats=<int>] [--output=<path>] [--baseline=<path>]
+
+Options:
+  -h, --help                Show this screen.
+  -V, --version             Show version.
+  -r, --repeats=<int>       Number of runs of each query [default: 5]
+  -o, --output=<path>       Where to save the results (JSON)
+  -b, --baseline=<path>     Results of a previous run to compare with
+
+Example:
+
+  To profile the installed database, and compare with a previous run
+
+    $ %(prog)s -o after.json -b before.json
+
+See '%(prog)s --help' for more information.
+
+"""
+
+import os
+import sys
+import json
+import pkg_resources
+
+from docopt import docopt
+
+version = pkg_resources.require('bob.db.fargo')[0].version
+
+
+def main(user_input=None):
+  """ Main function to profile the protocol queries.
+  """
+
+  # Parse the command-line arguments
+  if user_input is not None:
+      arguments = user_input
+  else:
+      arguments = sys.argv[1:]
+
+  prog = os.path.basename(sys.argv[0])
+  completions = dict(prog=prog, version=version,)
+  args = docopt(__doc__ % completions, argv=arguments, version='Query benchmark (%s)' % version,)
+
+  from bob.db.fargo.utils import database_file
+  from bob.db.fargo.benchmark import profile_queries
+
+  sqlite_file = args['<sqlite_file>'] or database_file()
+  results = profile_queries(sqlite_file, int(args['--repeats']))
+
+  baseline = {}
+  if args['--baseline']:
+    with open(args['--baseline']) as f:
+      for r in json.load(f):
+        baseline[(r['protocol'], r['group'], r['purpose'])] = r
+
+  for r in results:
+    line = '%-14s %-6s %-7s %5d rows %9.3f ms' % (r['protocol'], r['group'], r['purpose'], r['rows'], 1000 * r['seconds'])
+    key = (r['protocol'], r['group'], r['purpose'])
+    if key in baseline:
+      line += '  (was %9.3f ms)' % (1000 * baseline[key]['seconds'])
+    print(line)
+    for step in r['plan']:
+      print('    %s' % step)
+
+  if args['--output']:
+    with open(args['--output'], 'w') as f:
+      json.dump(results, f, indent=2)
+
+  return 0
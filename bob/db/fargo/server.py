@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Resident query server, shared by many processes through a Unix socket
+
+The server holds a single :py:class:`bob.db.fargo.Database`, with its
+protocol index built once. Clients send one JSON request per line, and
+receive one JSON response per line:
+
+  - request: ``{"method": "objects", "args": {"protocol": "mc-rgb"}}``
+  - response: ``{"result": [...]}``, or ``{"error": {"type": ..., "message": ...}}``
+
+Queries only return ids: each client fetches the clients on their own, and
+only the files it does not know yet, by id, see :py:class:`RemoteDatabase`.
+"""
+
+import os
+import json
+import stat
+import time
+import socket
+import tempfile
+import threading
+import collections
+import socketserver
+
+import numpy
+import bob.db.base
+
+from .table import FileTable
+from .filelist import ClientRow
+
+
+# the name of the default socket of the server
+SOCKET_NAME = 'bob.db.fargo.sock'
+
+# the number of latencies kept per method, for the statistics
+LATENCY_WINDOW = 10000
+
+# the errors raised again by the clients, other errors become RuntimeError
+ERRORS = {'ValueError': ValueError, 'KeyError': KeyError, 'TypeError': TypeError}
+
+
+def default_socket(create=False):
+  """Returns the default socket of the server, private to the current user
+
+  The socket is in ``$XDG_RUNTIME_DIR`` if it is set, or else in a
+  directory of the temporary directory named after the user id, which
+  only the user can access.
+
+  Parameters
+  ----------
+  create: bool
+    If set, the private directory is created if needed
+
+  Returns
+  -------
+  str:
+    The path of the socket
+
+  Raises
+  ------
+  RuntimeError:
+    if the private directory belongs to another user, or can be accessed
+    by other users
+
+  """
+  runtime = os.environ.get('XDG_RUNTIME_DIR')
+  if runtime:
+    return os.path.join(runtime, SOCKET_NAME)
+
+  directory = os.path.join(tempfile.gettempdir(), 'bob.db.fargo-%d' % os.getuid())
+  if create and not os.path.exists(directory):
+    os.mkdir(directory, 0o700)
+  if os.path.lexists(directory):
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+      raise RuntimeError("'%s' must be a directory owned and only accessible by the current user" % directory)
+  return os.path.join(directory, SOCKET_NAME)
+
+
+def _remove_stale_socket(path):
+  """Removes a socket left by a server which is not running anymore
+
+  Raises
+  ------
+  RuntimeError:
+    if a server still answers on the socket, or if the path is not a socket
+
+  """
+  if not os.path.lexists(path):
+    return
+  if not stat.S_ISSOCK(os.lstat(path).st_mode):
+    raise RuntimeError("'%s' exists and is not a socket" % path)
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    client.connect(path)
+  except (ConnectionRefusedError, FileNotFoundError):
+    os.unlink(path)
+    return
+  finally:
+    client.close()
+  raise RuntimeError("A server is already listening on '%s'" % path)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+  """Answers the requests of a client connection, one per line"""
+
+  def handle(self):
+    for line in self.rfile:
+      start = time.perf_counter()
+      method = None
+      try:
+        request = json.loads(line.decode('utf-8'))
+        method = request['method']
+        response = {'result': self.server.dispatch(method, request.get('args') or {})}
+      except Exception as e:
+        response = {'error': {'type': type(e).__name__, 'message': str(e)}}
+      self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+      self.wfile.flush()
+      self.server.record(method, time.perf_counter() - start)
+
+
+class QueryServer(socketserver.ThreadingUnixStreamServer):
+  """Serves the queries of a FARGO database on a Unix socket
+
+  Each connection is handled in its own thread, and all connections share
+  the same thread-safe :py:class:`bob.db.fargo.Database`.
+
+  Attributes
+  ----------
+  db: :py:class:`bob.db.fargo.Database`
+    The served database, using its protocol index
+
+  """
+
+  daemon_threads = True
+
+  def __init__(self, path, cache_size=128):
+    """ Init function
+
+    Parameters
+    ----------
+    path: str
+      The Unix socket to listen on. A socket left by a stopped server is
+      replaced, but a running server is never replaced.
+    cache_size: int
+      The number of query results cached by the database
+
+    Raises
+    ------
+    RuntimeError:
+      if a server is already listening on the socket
+
+    """
+    from .query import Database
+    _remove_stale_socket(path)
+    self.db = Database(use_index=True, threadsafe=True, cache_size=cache_size)
+    # warm the index and the file table up, before accepting connections
+    self.db._file_table()
+    self._started = time.time()
+    self._lock = threading.Lock()
+    self._latencies = {}
+    socketserver.ThreadingUnixStreamServer.__init__(self, path, _Handler)
+
+  def server_close(self):
+    socketserver.ThreadingUnixStreamServer.server_close(self)
+    if os.path.exists(self.server_address):
+      os.unlink(self.server_address)
+
+  def record(self, method, seconds):
+    """Records the latency of a request"""
+    with self._lock:
+      if method not in self._latencies:
+        self._latencies[method] = [0, collections.deque(maxlen=LATENCY_WINDOW)]
+      self._latencies[method][0] += 1
+      self._latencies[method][1].append(seconds)
+
+  def stats(self):
+    """Returns the number of requests and their latencies (in ms), per method"""
+    from .benchmark import percentile
+    with self._lock:
+      latencies = dict((m, (c, list(l))) for m, (c, l) in self._latencies.items())
+    methods = {}
+    for method, (count, times) in latencies.items():
+      methods[str(method)] = {'requests': count, 'p50': 1000 * percentile(times, 50),
+          'p95': 1000 * percentile(times, 95), 'max': 1000 * max(times)}
+    return {'uptime': time.time() - self._started, 'requests': sum(c for c, _ in latencies.values()), 'methods': methods}
+
+  def dispatch(self, method, args):
+    """Runs a request
+
+    Parameters
+    ----------
+    method: str
+      The request: 'files', 'clients', 'client_ids', 'objects',
+      'protocol_names' or 'stats'
+    args: dict
+      The keyword arguments of the request
+
+    Returns
+    -------
+    object:
+      The result, which can be converted to JSON
+
+    """
+    db = self.db
+    if method == 'files':
+      table = db._file_table()
+      ids = numpy.array(args['ids'], dtype=numpy.int64)
+      positions = numpy.minimum(table.positions(ids), max(len(table) - 1, 0))
+      if len(ids) and (not len(table) or (table.id[positions] != ids).any()):
+        raise KeyError("Unknown file ids")
+      return [[f.id, f.client_id, f.light, f.device, f.recording, f.modality, f.pose, f.path] for f in table[positions]]
+    if method == 'clients':
+      return [[c.id, c.group] for c in db.clients()]
+    if method == 'client_ids':
+      return [c.id for c in db.clients(args.get('protocol'), args.get('groups'))]
+    if method == 'objects':
+      return db.objects(as_table=True, **args).id.tolist()
+    if method == 'protocol_names':
+      return db.protocol_names()
+    if method == 'stats':
+      return self.stats()
+    raise ValueError("Unknown method '%s'" % method)
+
+
+class RemoteDatabase(bob.db.base.Database):
+  """FARGO database queried through a :py:class:`QueryServer`
+
+  It provides the query API of :py:class:`bob.db.fargo.Database`. Queries
+  only transfer ids: the files are fetched by id, the first time a query
+  returns them, and the clients are fetched on their own, the first time
+  they are needed. Queries return :py:class:`bob.db.fargo.table.FileRow`
+  and :py:class:`bob.db.fargo.filelist.ClientRow` objects.
+
+  Attributes
+  ----------
+  path: str
+    The Unix socket of the server
+  original_directory: str
+    Path where the database is stored
+  original_extension: str
+    Extension of files in the database
+
+  """
+
+  group_choices = ('world', 'dev', 'eval')
+  purpose_choices = ('train', 'enroll', 'probe')
+
+  def __init__(self, path=None, original_directory=None, original_extension=None, protocol='mc-rgb'):
+    """ Init function
+
+    Parameters
+    ----------
+    path: str
+      The Unix socket of the server, see :py:func:`default_socket` by default
+    original_directory: str
+      Path where the database is stored
+    original_extension: str
+      Extension of files in the database
+
+    """
+    super(RemoteDatabase, self).__init__(original_directory, original_extension)
+    self.path = path or default_socket()
+    self.protocol = protocol
+    self._lock = threading.Lock()
+    self._socket = None
+    self._stream = None
+    self._pid = None
+    self._rows = {}
+    self._clients = None
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    for key in ('_lock', '_socket', '_stream'):
+      del state[key]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+    self._socket = None
+    self._stream = None
+
+  def close(self):
+    """Closes the connection to the server"""
+    with self._lock:
+      if self._socket is not None:
+        self._stream.close()
+        self._socket.close()
+      self._socket = self._stream = None
+
+  def _request(self, method, **args):
+    """Sends a request to the server, and returns its result"""
+    with self._lock:
+      # a connection is never shared with a forked process
+      if self._socket is None or self._pid != os.getpid():
+        if self._socket is not None:
+          # the connection inherited from the parent process
+          self._stream.close()
+          self._socket.close()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(self.path)
+        self._stream = self._socket.makefile('rwb')
+        self._pid = os.getpid()
+      self._stream.write(json.dumps({'method': method, 'args': args}).encode('utf-8') + b'\n')
+      self._stream.flush()
+      line = self._stream.readline()
+    if not line:
+      raise RuntimeError("The FARGO query server at '%s' closed the connection" % self.path)
+    response = json.loads(line.decode('utf-8'))
+    if 'error' in response:
+      raise ERRORS.get(response['error']['type'], RuntimeError)(response['error']['message'])
+    return response['result']
+
+  def _client_rows(self):
+    """Fetches the clients, on first use"""
+    if self._clients is None:
+      self._clients = dict((i, ClientRow(i, g)) for i, g in self._request('clients'))
+    return self._clients
+
+  def _files(self, ids):
+    """Returns the table of the given file ids, fetching the unknown ones"""
+    missing = [k for k in ids if k not in self._rows]
+    if missing:
+      self._rows.update((row[0], tuple(row)) for row in self._request('files', ids=missing))
+    return FileTable.from_rows(self._rows[k] for k in ids)
+
+  @property
+  def modalities(self):
+    return ['rgb', 'nir', 'depth']
+
+  def groups(self, protocol=None):
+    """Returns the names of all registered groups
+
+    Parameters
+    ----------
+    protocol: str
+      ignored, since the group are the same across protocols.
+
+    """
+    return self.group_choices
+
+  def purposes(self):
+    """Returns purposes
+
+    """
+    return self.purpose_choices
+
+  def protocol_names(self):
+    """Returns all registered protocol names
+
+    """
+    return self._request('protocol_names')
+
+  def stats(self):
+    """Returns the request statistics of the server
+
+    Returns
+    -------
+    dict:
+      The uptime in seconds, the total number of requests, and for each
+      method, its number of requests and its p50, p95 and max latencies
+      in milliseconds
+
+    """
+    return self._request('stats')
+
+  def clients(self, protocol=None, groups=None):
+    """Returns a set of clients for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.clients`
+
+    """
+    clients = self._client_rows()
+    return [clients[k] for k in self._request('client_ids', protocol=protocol, groups=groups)]
+
+  def models(self, protocol=None, groups=None):
+    """Returns a set of models for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.models`
+
+    """
+    return self.clients(protocol, groups)
+
+  def model_ids(self, protocol=None, groups=None):
+    """Returns a set of models ids for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.model_ids`
+
+    """
+    return self._request('client_ids', protocol=protocol, groups=groups)
+
+  def client(self, id):
+    """Returns the client object of the specified id.
+
+    Raises
+    ------
+    KeyError:
+      if the client does not exist.
+
+    """
+    return self._client_rows()[id]
+
+  def objects(self, protocol=None, purposes=None, model_ids=None, groups=None, modality=None, as_table=False):
+    """Returns a set of Files for the specific query by the user.
+
+    See :py:meth:`bob.db.fargo.Database.objects`
+
+    Returns
+    -------
+    lst:
+      A list of :py:class:`bob.db.fargo.table.FileRow` which have the given
+      properties, or a :py:class:`bob.db.fargo.table.FileTable` if
+      ``as_table`` is set.
+
+    """
+    from collections.abc import Iterable
+    # NumPy integers cannot be converted to JSON
+    if model_ids is not None and isinstance(model_ids, Iterable) and not isinstance(model_ids, str):
+      model_ids = [int(k) for k in model_ids]
+    elif model_ids is not None:
+      model_ids = int(model_ids)
+
+    ids = self._request('objects', protocol=protocol, purposes=purposes, model_ids=model_ids, groups=groups, modality=modality)
+    table = self._files(ids)
+    return table if as_table else list(table)
+
+
+def serve(path=None, cache_size=128, ready=None):
+  """Serves the FARGO database until interrupted
+
+  Parameters
+  ----------
+  path: str
+    The Unix socket to listen on, see :py:func:`default_socket` by default
+  cache_size: int
+    The number of query results cached by the database
+  ready: callable
+    If given, it is called with the server once it accepts connections
+
+  """
+  server = QueryServer(path or default_socket(create=True), cache_size)
+  try:
+    if ready is not None:
+      ready(server)
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
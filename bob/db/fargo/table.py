@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Compact, array-backed containers for FARGO files
+"""
+
+import os
+import numpy
+
+
+class FileRow(object):
+  """Lightweight, read-only view of a file of the FARGO database
+
+  It mimics the attributes of :py:class:`bob.db.fargo.models.File`,
+  without carrying any SQLAlchemy state.
+
+  Attributes
+  ----------
+  id: int
+    The file id
+  client_id: int
+    The id of the client associated to this file
+  light: str
+    The light condition of the image
+  device: str
+    The device with which this file was acquired
+  recording: str
+    The recording from which this file originated
+  modality: str
+    The modality from which this file was recorded
+  pose: str
+    The pose of the face in the image
+  path: str
+    The path on the disk where this file is stored.
+
+  """
+
+  __slots__ = ('id', 'client_id', 'light', 'device', 'recording', 'modality', 'pose', 'path')
+
+  def __init__(self, id, client_id, light, device, recording, modality, pose, path):
+    self.id = id
+    self.client_id = client_id
+    self.light = light
+    self.device = device
+    self.recording = recording
+    self.modality = modality
+    self.pose = pose
+    self.path = path
+
+  def __repr__(self):
+    return "File('%s')" % self.path
+
+  def __lt__(self, other):
+    return self.id < other.id
+
+  def __eq__(self, other):
+    return isinstance(other, FileRow) and self.id == other.id
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self.id)
+
+  def make_path(self, directory=None, extension=None):
+    """Wraps the current path so that a complete path is formed
+
+    Parameters
+    ----------
+    directory
+      An optional directory name that will be prefixed to the returned result.
+    extension
+      An optional extension that will be suffixed to the returned filename.
+      extension normally includes the leading ``.`` character
+
+    Returns
+    -------
+    str:
+      the newly generated file path.
+
+    """
+    if not directory:
+      directory = ''
+    if not extension:
+      extension = ''
+    return str(os.path.join(directory, self.path + extension))
+
+
+class FileTable(object):
+  """Column-oriented table of FARGO files
+
+  Ids are stored as integer arrays, the categorical attributes (light,
+  device, recording, modality and pose) as ``uint8`` codes into a small
+  array of categories, and the paths as a single bytes array.
+  Indexing with an integer lazily creates a :py:class:`FileRow`, indexing
+  with a slice, a boolean mask or an array of positions returns a new
+  :py:class:`FileTable`.
+
+  Attributes
+  ----------
+  columns: tuple of str
+    The names of the columns, in the order of the rows given to
+    :py:meth:`from_rows`
+
+  """
+
+  columns = ('id', 'client_id', 'light', 'device', 'recording', 'modality', 'pose', 'path')
+  categorical = ('light', 'device', 'recording', 'modality', 'pose')
+
+  def __init__(self, ids, client_ids, codes, categories, paths):
+    """ Init function
+
+    Use :py:meth:`from_rows` to build a table from query results.
+
+    Parameters
+    ----------
+    ids: :py:class:`numpy.ndarray`
+      The file ids
+    client_ids: :py:class:`numpy.ndarray`
+      The client ids
+    codes: dict
+      The ``uint8`` codes of each categorical column
+    categories: dict
+      The categories (array of str) of each categorical column
+    paths: :py:class:`numpy.ndarray`
+      The paths, as bytes
+
+    """
+    self._ids = ids
+    self._client_ids = client_ids
+    self._codes = codes
+    self._categories = categories
+    self._paths = paths
+
+  @classmethod
+  def from_rows(cls, rows):
+    """Builds a table from an iterable of rows
+
+    Parameters
+    ----------
+    rows: iterable of tuple
+      (id, client_id, light, device, recording, modality, pose, path) tuples
+
+    Returns
+    -------
+    :py:class:`FileTable`:
+      The table, with rows in the given order
+
+    """
+    rows = list(rows)
+    n = len(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(cls.columns)
+
+    ids = numpy.array(columns[0], dtype=numpy.int64).reshape(n)
+    client_ids = numpy.array(columns[1], dtype=numpy.int64).reshape(n)
+    codes = {}
+    categories = {}
+    for k, name in enumerate(cls.categorical):
+      values = numpy.array([str(v) for v in columns[k + 2]], dtype=str).reshape(n)
+      categories[name], inverse = numpy.unique(values, return_inverse=True)
+      codes[name] = inverse.astype(numpy.uint8).reshape(n)
+    paths = numpy.array([str(p).encode('utf-8') for p in columns[7]], dtype=bytes).reshape(n)
+    return cls(ids, client_ids, codes, categories, paths)
+
+  def __len__(self):
+    return len(self._ids)
+
+  def __iter__(self):
+    for k in range(len(self)):
+      yield self[k]
+
+  def __getitem__(self, key):
+    if isinstance(key, (int, numpy.integer)):
+      return FileRow(int(self._ids[key]), int(self._client_ids[key]),
+          *([str(self._categories[c][self._codes[c][key]]) for c in self.categorical] +
+            [self._paths[key].decode('utf-8')]))
+    return FileTable(self._ids[key], self._client_ids[key],
+        dict((c, v[key]) for c, v in self._codes.items()),
+        self._categories, self._paths[key])
+
+  def __repr__(self):
+    return "FileTable(%d files)" % len(self)
+
+  @property
+  def id(self):
+    """The file ids, as a :py:class:`numpy.ndarray`"""
+    return self._ids
+
+  @property
+  def client_id(self):
+    """The client ids, as a :py:class:`numpy.ndarray`"""
+    return self._client_ids
+
+  @property
+  def path(self):
+    """The paths, as a list of str"""
+    return [p.decode('utf-8') for p in self._paths]
+
+  def column(self, name):
+    """Returns the decoded values of a column
+
+    Parameters
+    ----------
+    name: str
+      One of :py:attr:`columns`
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      The values of the column
+
+    """
+    if name == 'id':
+      return self._ids
+    if name == 'client_id':
+      return self._client_ids
+    if name == 'path':
+      return numpy.array(self.path)
+    if name not in self._codes:
+      raise ValueError("Unknown column '%s', valid columns are %s" % (name, self.columns))
+    return self._categories[name][self._codes[name]]
+
+  def positions(self, ids):
+    """Returns the positions of the given file ids in this table
+
+    The table must be sorted by id.
+
+    Parameters
+    ----------
+    ids: :py:class:`numpy.ndarray`
+      The file ids, which must all be present in the table
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`:
+      The positions of the ids
+
+    """
+    return numpy.searchsorted(self._ids, ids)
+
+  def make_paths(self, directory=None, extension=None):
+    """Returns the complete paths of all files
+
+    See :py:meth:`FileRow.make_path` for the parameters.
+
+    Returns
+    -------
+    lst:
+      A list of str
+
+    """
+    directory = directory or ''
+    extension = extension or ''
+    return [str(os.path.join(directory, p + extension)) for p in self.path]
+
+  @property
+  def nbytes(self):
+    """The number of bytes used by the arrays of this table"""
+    return self._ids.nbytes + self._client_ids.nbytes + self._paths.nbytes + \
+        sum(v.nbytes for v in self._codes.values())
@@ -31,7 +31,10 @@ def db_available(test):
 def test_clients():
 
   # test whether the correct number of clients is returned
-  db = bob.db.fargo.Database()
+  _check_clients(bob.db.fargo.Database())
+
+
+def _check_clients(db):
   assert len(db.groups()) == 3
   assert len(db.clients()) == 75
   assert len(db.clients(groups='world')) == 25
@@ -43,8 +46,10 @@ def test_clients():
 def test_objects():
 #  # tests if the right number of File objects is returned
   
-  db = bob.db.fargo.Database()
+  _check_objects(bob.db.fargo.Database())
+
 
+def _check_objects(db):
   assert len(db.objects(protocol='mc-rgb', groups='world')) == 1000
   assert len(db.objects(protocol='mc-rgb', groups='dev', purposes='enroll')) == 500
   assert len(db.objects(protocol='mc-rgb', groups='dev', purposes='enroll', model_ids=26)) == 20
@@ -80,8 +85,10 @@ def test_objects():
 def test_heterogeneous():    
     # Test heterogeous protocols    
 
-    db = bob.db.fargo.Database()
+    _check_heterogeneous(bob.db.fargo.Database())
+
 
+def _check_heterogeneous(db):
     groups = ["dev", "eval"]
 
     ##############
@@ -134,3 +141,776 @@ def test_heterogeneous():
             assert len(modality) == 1
             assert list(modality)[0] == m
  
+
+
+@db_available
+def test_index():
+    # The in-memory index should give the same answers as the SQL queries
+
+    db = bob.db.fargo.Database()
+    idb = bob.db.fargo.Database(use_index=True)
+
+    assert idb.protocol_names() == db.protocol_names()
+    assert [c.id for c in idb.clients()] == [c.id for c in db.clients()]
+    assert idb.model_ids(groups='dev') == db.model_ids(groups='dev')
+
+    for p in ('mc-rgb', 'ud-nir', 'uo-rgb2depth', 'pos-yaw'):
+        assert [f.id for f in idb.objects(protocol=p)] == [f.id for f in db.objects(protocol=p)]
+        assert [f.id for f in idb.objects(protocol=p, groups='world', modality='rgb')] == \
+            [f.id for f in db.objects(protocol=p, groups='world', modality='rgb')]
+        for g, m in (('dev', 26), ('eval', 51)):
+            for purpose in ('enroll', 'probe'):
+                assert [f.id for f in idb.objects(protocol=p, groups=g, purposes=purpose, model_ids=m)] == \
+                    [f.id for f in db.objects(protocol=p, groups=g, purposes=purpose, model_ids=m)]
+
+
+@db_available
+def test_table():
+    # The table result mode should contain the same files as the ORM one
+
+    db = bob.db.fargo.Database()
+    idb = bob.db.fargo.Database(use_index=True)
+
+    for p in ('mc-rgb', 'uo-rgb2depth'):
+        files = db.objects(protocol=p)
+        for d in (db, idb):
+            table = d.objects(protocol=p, as_table=True)
+            assert len(table) == len(files)
+            assert list(table.id) == [f.id for f in files]
+            assert list(table.column('modality')) == [f.modality for f in files]
+            assert [f.make_path('x', '.png') for f in table] == [f.make_path('x', '.png') for f in files]
+
+
+@db_available
+def test_iter_objects():
+    # Streaming should give the same files, in the same order
+
+    db = bob.db.fargo.Database()
+    for p in ('mc-rgb', 'ud-rgb2nir'):
+        assert [f.id for f in db.iter_objects(protocol=p, chunk_size=100)] == [f.id for f in db.objects(protocol=p)]
+    assert list(db.iter_objects(protocol='mc-rgb', groups='dev', purposes='train')) == []
+
+
+@db_available
+def test_objects_many():
+    # Batched queries should give the same files as one query at a time
+
+    db = bob.db.fargo.Database()
+    specs = [
+      dict(protocol='mc-rgb', groups='world'),
+      dict(protocol='ud-rgb2nir', groups='world', modality='nir'),
+      dict(protocol='uo-depth', groups='dev', purposes='enroll', model_ids=26),
+      dict(protocol='pos-pitch', groups='eval', purposes='probe'),
+      dict(protocol='mc-rgb', groups='dev', purposes='train'),
+    ]
+    for spec, files in zip(specs, db.objects_many(specs)):
+        assert [f.id for f in files] == [f.id for f in db.objects(**spec)]
+
+
+@db_available
+def test_comparison_pairs():
+    # Dense probing: every model is compared to every probe
+
+    db = bob.db.fargo.Database()
+    pairs = db.comparison_pairs('ud-nir', 'dev')
+    assert list(pairs.model_ids) == db.model_ids(groups='dev')
+    assert len(pairs.enroll_ids) == 500
+    assert len(pairs.probe_ids) == 1000
+    assert len(pairs.model_index) == len(pairs.probe_index) == 25 * 1000
+    assert list(pairs.probe_ids) == [f.id for f in db.objects(protocol='ud-nir', groups='dev', purposes='probe')]
+    enrolled = pairs.enroll_ids[pairs.enroll_models == 0]
+    assert list(enrolled) == [f.id for f in db.objects(protocol='ud-nir', groups='dev', purposes='enroll', model_ids=int(pairs.model_ids[0]))]
+
+
+@db_available
+def test_cache():
+    # Repeated queries should be served from the cache
+
+    db = bob.db.fargo.Database(cache_size=2)
+    first = db.objects(protocol='mc-rgb', groups='world')
+    info = db.cache_info()
+    second = db.objects(protocol='mc-rgb', groups='world')
+    assert [f.id for f in first] == [f.id for f in second]
+    assert db.cache_info()['hits'] > info['hits']
+
+    db.clients(groups='dev')
+    db.clients(groups='eval')
+    assert db.cache_info()['size'] == 2
+    assert db.cache_info()['evictions'] > 0
+
+    db = bob.db.fargo.Database(cache_size=0)
+    assert len(db.objects(protocol='mc-rgb', groups='world')) == 1000
+    assert db.cache_info()['capacity'] == 0
+
+
+@db_available
+def test_threadsafe():
+    # Many threads should be able to query a single instance concurrently
+
+    import threading
+
+    protocols = ('mc-rgb', 'ud-nir', 'uo-depth', 'mc-rgb2nir', 'pos-yaw')
+    expected = {}
+    db = bob.db.fargo.Database(cache_size=0)
+    for p in protocols:
+        expected[p] = [f.id for f in db.objects(protocol=p)]
+
+    for kwargs in (dict(cache_size=0), dict(cache_size=8), dict(use_index=True)):
+        db = bob.db.fargo.Database(threadsafe=True, **kwargs)
+        errors = []
+
+        def worker(k):
+            try:
+                for i in range(10):
+                    p = protocols[(k + i) % len(protocols)]
+                    files = db.objects(protocol=p)
+                    if [f.id for f in files] != expected[p]:
+                        errors.append("wrong results for protocol '%s'" % p)
+                    # relationships of shared objects do not go through the session of another thread
+                    if any(f.client.id != f.client_id for f in files[::50]):
+                        errors.append("wrong clients for protocol '%s'" % p)
+                    if len(db.clients()) != 75:
+                        errors.append("wrong number of clients")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(k,)) for k in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+
+        # the files of the other queries are detached as well, and used in another thread
+        from sqlalchemy.orm import object_session
+        many = db.objects_many([dict(protocol=p) for p in protocols[:2]])
+        iterated = list(db.iter_objects(protocol=protocols[2]))
+        assert [[f.id for f in files] for files in many] == [expected[p] for p in protocols[:2]]
+        assert [f.id for f in iterated] == expected[protocols[2]]
+
+        def reader(files):
+            try:
+                for f in files[::50]:
+                    if object_session(f) is not None or f.client.id != f.client_id:
+                        errors.append("file %d is attached to the session of another thread" % f.id)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=reader, args=(files,)) for files in many + [iterated]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+
+
+def _count_probes(db, protocol):
+    return len(db.objects(protocol=protocol, groups='dev', purposes='probe'))
+
+
+@db_available
+def test_pickle_and_fork():
+    # A database handle should be usable after pickling and in child processes
+
+    import pickle
+    import multiprocessing
+
+    for kwargs in (dict(), dict(use_index=True), dict(threadsafe=True)):
+        db = bob.db.fargo.Database(**kwargs)
+        assert len(db.objects(protocol='mc-rgb', groups='world')) == 1000
+
+        copy = pickle.loads(pickle.dumps(db))
+        assert len(copy.objects(protocol='mc-rgb', groups='world')) == 1000
+        assert len(copy.clients()) == 75
+
+        pool = multiprocessing.Pool(2)
+        try:
+            counts = pool.starmap(_count_probes, [(db, 'mc-rgb'), (db, 'ud-nir')])
+        finally:
+            pool.close()
+            pool.join()
+        assert counts == [500, 1000]
+
+    if hasattr(os, 'fork'):
+        db = bob.db.fargo.Database(use_index=True)
+        db.objects(protocol='mc-rgb')
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if _count_probes(db, 'ud-nir') == 1000 else 1)
+        assert os.waitpid(pid, 0)[1] == 0
+
+
+@db_available
+def test_lazy_session():
+    # Validating or deleting a database should not open a connection
+
+    db = bob.db.fargo.Database()
+    assert db.is_valid()
+    assert db.m_session is None
+    db.__del__()
+    assert db.m_session is None
+    del db
+
+
+def test_lazy_import():
+    # Importing the package should neither load SQLAlchemy nor pkg_resources
+
+    import subprocess
+    p = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import bob.db.fargo'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    _, err = p.communicate()
+    assert p.returncode == 0, err
+
+    # each line is "import time: self [us] | cumulative | imported package"
+    imported = [line.split('|')[-1].strip() for line in err.splitlines() if line.startswith('import time:')]
+    assert 'bob.db.fargo' in imported
+    for module in ('sqlalchemy', 'pkg_resources', 'bob.db.fargo.query', 'bob.db.fargo.models'):
+        assert module not in imported, "'import bob.db.fargo' should not import '%s'" % module
+
+
+@db_available
+def test_filelist():
+    # The exported file lists should give the same results as the SQLite database
+
+    import shutil
+    import tempfile
+    from .filelist import write_file_lists
+
+    db = bob.db.fargo.Database()
+    directory = tempfile.mkdtemp(prefix='bobtest_')
+    try:
+        write_file_lists(db, directory)
+        fdb = bob.db.fargo.FileListDatabase(directory)
+        _check_clients(fdb)
+        _check_objects(fdb)
+        _check_heterogeneous(fdb)
+
+        assert fdb.protocol_names() == db.protocol_names()
+        for p in ('mc-rgb', 'uo-rgb2depth'):
+            files = db.objects(protocol=p)
+            assert [(f.id, f.client_id, f.modality, f.make_path('x', '.png')) for f in fdb.objects(protocol=p)] == \
+                [(f.id, f.client_id, f.modality, f.make_path('x', '.png')) for f in files]
+
+        # no SQLAlchemy import needed
+        import subprocess
+        code = "import sys, bob.db.fargo; db = bob.db.fargo.FileListDatabase(%r); db.objects(protocol='mc-rgb'); " \
+            "assert 'sqlalchemy' not in sys.modules" % directory
+        assert subprocess.call([sys.executable, '-c', code]) == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+@db_available
+def test_statistics():
+    # Aggregated counts should match the number of retrieved objects
+
+    db = bob.db.fargo.Database()
+    stats = db.statistics(by='group')
+    assert list(stats['group']) == sorted(['world', 'dev', 'eval'])
+
+    stats = db.statistics(protocol='ud-nir', by=('group', 'purpose'))
+    for row in stats:
+        assert row['count'] == len(db.objects(protocol='ud-nir', groups=row['group'], purposes=row['purpose']))
+
+    stats = db.statistics(protocol='mc-rgb2depth', by=('group', 'modality'))
+    counts = dict(((r['group'], r['modality']), r['count']) for r in stats)
+    assert counts[('world', 'depth')] == 1000
+    assert counts[('dev', 'rgb')] == 500
+
+    stats = db.statistics(by=('client', 'light'))
+    assert len(set(stats['client'])) == 75
+
+    try:
+        db.statistics(by='purpose')
+        assert False, "counting by purpose requires a protocol"
+    except ValueError:
+        pass
+
+
+@db_available
+def test_annotations():
+    # Packed annotations should be the same as the ones read file by file
+
+    import json
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp(prefix='bobtest_')
+    try:
+        db = bob.db.fargo.Database(annotation_directory=directory, annotation_extension='.json')
+        files = db.objects(protocol='mc-rgb', groups='dev', purposes='enroll')
+        for k, f in enumerate(files[:10]):
+            filename = f.make_path(directory, '.json')
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as a:
+                json.dump({'reye': [10 + k, 20], 'leye': [10 + k, 40]}, a)
+
+        unpacked = db.annotations(files)
+        assert unpacked[0] == {'reye': (10., 20.), 'leye': (10., 40.)}
+        assert unpacked[-1] is None
+        assert db.annotations(files[9]) == {'reye': (19., 20.), 'leye': (19., 40.)}
+
+        assert db.pack_annotations(files) == 10
+        assert os.path.exists(os.path.join(directory, 'annotations.npy'))
+        packed = bob.db.fargo.Database(annotation_directory=directory, annotation_extension='.json')
+        assert packed.annotations(files) == unpacked
+        assert packed.annotation_vectors(files).shape == (len(files), 8)
+
+        # files which were not packed are read from disk
+        filename = files[-1].make_path(directory, '.json')
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as a:
+            json.dump({'reye': [1, 2], 'leye': [3, 4]}, a)
+        assert bob.db.fargo.Database(annotation_directory=directory, annotation_extension='.json').annotations(files)[-1] == \
+            {'reye': (1., 2.), 'leye': (3., 4.)}
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_loader():
+    # Images should be stacked per modality, in the order of the files
+
+    import numpy, threading
+    from .table import FileRow
+    from .loader import load_batch, iter_batches
+
+    files = [FileRow(k, 1, 'controlled', 'laptop', '0', 'rgb' if k % 2 else 'depth', 'frontal', '1/%d' % k) for k in range(10)]
+    threads = set()
+
+    def load(path):
+        threads.add(threading.current_thread().name)
+        k = int(path.split('/')[-1].split('.')[0])
+        return numpy.full((3, 4, 5) if k % 2 else (4, 5), k, dtype=numpy.uint8)
+
+    images = load_batch(files, 'images', '.png', workers=3, load=load)
+    assert sorted(images) == ['depth', 'rgb']
+    assert images['rgb'].shape == (5, 3, 4, 5)
+    assert images['depth'].shape == (5, 4, 5)
+    assert list(images['rgb'][:, 0, 0, 0]) == [1, 3, 5, 7, 9]
+    assert list(images['depth'][:, 0, 0]) == [0, 2, 4, 6, 8]
+
+    for prefetch in (True, False):
+        threads.clear()
+        batches = list(iter_batches(files, 4, workers=2, prefetch=prefetch, load=load))
+        assert [len(b) for b, _ in batches] == [4, 4, 2]
+        assert list(batches[2][1]['depth'][:, 0, 0]) == [8]
+        # a single decoding pool is used by all batches and modalities (and the prefetching thread)
+        pools = set(name.split('_')[0] for name in threads if name.startswith('ThreadPoolExecutor'))
+        assert len(pools) == (2 if prefetch else 1)
+
+
+def test_packed():
+    # Packed images should be read back without decoding
+
+    import numpy
+    import shutil
+    import tempfile
+    from .table import FileRow
+    from .packed import pack_images, PackedImages
+
+    files = [FileRow(k, 1, 'controlled', 'laptop', '0', 'rgb' if k % 2 else 'depth', 'frontal', '1/%d' % k) for k in range(20, 0, -1)]
+
+    def load(path):
+        k = int(path.split('/')[-1].split('.')[0])
+        return numpy.full((3, 4, 5) if k % 2 else (4, 5), k, dtype=numpy.uint16)
+
+    directory = tempfile.mkdtemp(prefix='bobtest_')
+    try:
+        assert pack_images(files, 'images', '.png', directory, workers=2, batch_size=3, load=load) == {'rgb': 10, 'depth': 10}
+        packed = PackedImages(directory)
+        assert packed.modalities == ['depth', 'rgb']
+        for f in files:
+            image = packed[f]
+            assert image.shape == load(f.path).shape
+            assert (image == f.id).all()
+        rgb = [f for f in files if f.modality == 'rgb']
+        assert list(packed.load(rgb)[:, 0, 0, 0]) == [f.id for f in rgb]
+        try:
+            packed[FileRow(42, 1, 'controlled', 'laptop', '0', 'rgb', 'frontal', '1/42')]
+            assert False, "file 42 was not packed"
+        except KeyError:
+            pass
+    finally:
+        shutil.rmtree(directory)
+
+
+@db_available
+def test_async():
+    # Queries and image loading should be usable from an event loop
+
+    import asyncio
+    import numpy
+
+    def load(path):
+        return numpy.full((2, 2), len(path), dtype=numpy.uint8)
+
+    async def consume(db, protocol):
+        files = await db.aobjects(protocol=protocol, groups='dev', purposes='enroll')
+        images = []
+        async for f, image in db.aiter_images(files[:20], 'images', '.png', max_pending=4, load=load):
+            images.append((f, image))
+        return files, images
+
+    loop = asyncio.new_event_loop()
+    try:
+        # the session of a database which is not threadsafe cannot be used from the query threads
+        try:
+            loop.run_until_complete(consume(bob.db.fargo.Database(), 'mc-rgb'))
+            assert False, "aobjects() requires threadsafe=True"
+        except ValueError:
+            pass
+
+        with bob.db.fargo.Database(threadsafe=True) as db:
+            results = loop.run_until_complete(asyncio.gather(consume(db, 'mc-rgb'), consume(db, 'ud-nir')))
+        assert db._executors == {}
+    finally:
+        loop.close()
+
+    for files, images in results:
+        assert len(files) == 500
+        assert [f.id for f, _ in images] == [f.id for f in files[:20]]
+        assert all((image == len(f.make_path('images', '.png'))).all() for f, image in images)
+
+
+def _make_images(directory, clients):
+    # Creates an (empty) image tree with the layout of the extracted FARGO images:
+    # one frontal image per condition, and yaw/pitch images for controlled color streams
+
+    for client in clients:
+        for light in ('controlled', 'dark', 'outdoor'):
+            for device in ('SR300-laptop', 'SR300-mobile'):
+                for recording in ('0', '1'):
+                    for stream in ('color', 'ir', 'depth'):
+                        poses = ('', 'yaw', 'pitch') if light == 'controlled' and stream == 'color' else ('',)
+                        for pose in poses:
+                            d = os.path.join(directory, '%03d' % client, light, device, recording, stream, pose)
+                            if not os.path.exists(d):
+                                os.makedirs(d)
+                            open(os.path.join(d, '00.png'), 'w').close()
+
+
+def _create(directory, dbfile, **kwargs):
+    # Runs the create command on an image tree
+
+    import argparse
+    from .create import create
+    args = dict(recreate=True, verbose=0, type='sqlite', files=[dbfile], imagesdir=directory + os.sep)
+    args.update(kwargs)
+    return create(argparse.Namespace(**args))
+
+
+def _association_counts(dbfile):
+    # Returns the number of files of each (protocol, group, purpose)
+
+    from bob.db.base.utils import session_try_readonly
+    from sqlalchemy import func
+    from .models import Protocol, ProtocolPurpose, protocolPurpose_file_association as association
+    session = session_try_readonly('sqlite', dbfile)
+    try:
+        q = session.query(Protocol.name, ProtocolPurpose.group, ProtocolPurpose.purpose, func.count(association.c.file_id)).\
+            join(ProtocolPurpose, ProtocolPurpose.protocol_id == Protocol.id).\
+            join(association, association.c.protocolPurpose_id == ProtocolPurpose.id).\
+            group_by(Protocol.name, ProtocolPurpose.group, ProtocolPurpose.purpose)
+        return dict(((p, g, u), c) for p, g, u, c in q)
+    finally:
+        session.close()
+
+
+def test_create():
+    # The declarative protocols should select the expected files of a synthetic image tree
+
+    import tempfile, shutil
+    from .protocols import PROTOCOLS
+
+    assert len(PROTOCOLS) == 26
+    assert list(PROTOCOLS)[:5] == ['mc-rgb', 'mc-nir', 'mc-depth', 'mc-rgb2nir', 'mc-rgb2depth']
+    assert PROTOCOLS['ud-rgb2nir']['train']['modality'] == ('rgb', 'nir')
+
+    directory = tempfile.mkdtemp(prefix='bob_db_fargo_')
+    try:
+        images = os.path.join(directory, 'images')
+        dbfile = os.path.join(directory, 'db', 'db.sql3')
+        _make_images(images, (1, 2, 26, 51))
+        # stray entries next to the client directories are ignored
+        for name in ('checksums.json', '.DS_Store'):
+            open(os.path.join(images, name), 'w').close()
+        os.makedirs(os.path.join(images, 'lost+found'))
+
+        from .create import scan_files
+        scanned = list(scan_files(images, workers=2))
+        assert len(scanned) == 4 * 44
+        assert scanned == sorted(scanned, key=lambda f: (f[0], f[1]))
+        assert ('pitch', 'rgb') in set((f[6], f[5]) for f in scanned)
+
+        import io, contextlib
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            assert _create(images, dbfile, compare_ingestion=True, workers=2) == 0
+        # both ingestion pipelines are timed on the same files
+        ingested = [line.split()[:3] for line in output.getvalue().splitlines() if ' ingested ' in line]
+        assert ingested == [['per-file', 'ingested', str(4 * 44)], ['bulk', 'ingested', str(4 * 44)]]
+        # the summary gives the number of files associated to each protocol
+        summary = dict(line.split()[:2] for line in output.getvalue().splitlines() if 'associated files' in line)
+        assert len(summary) == 26
+        assert summary['mc-rgb'] == str(8 + 2 * 2 + 2 * 2)
+
+        counts = _association_counts(dbfile)
+        # 2 world clients, 2 devices and 2 recordings
+        assert counts[('mc-rgb', 'world', 'train')] == 8
+        assert counts[('mc-rgb2depth', 'world', 'train')] == 16
+        # 1 client per group, 2 devices, first recording
+        assert counts[('mc-nir', 'dev', 'enroll')] == 2
+        assert counts[('uo-rgb2nir', 'eval', 'enroll')] == 2
+        # 1 client per group, 2 devices, second (or both) recordings
+        assert counts[('mc-depth', 'dev', 'probe')] == 2
+        assert counts[('ud-rgb2depth', 'eval', 'probe')] == 4
+        assert counts[('pos-yaw', 'dev', 'probe')] == 4
+        assert counts[('pos-pitch', 'eval', 'probe')] == 4
+        assert len(counts) == 26 * 5
+
+        # nothing changed
+        assert os.path.exists(dbfile + '.manifest.json')
+        assert _create(images, dbfile, recreate=False, update=True) == 0
+        assert _association_counts(dbfile) == counts
+
+        # a client is removed, another one added, and images of a third one are removed
+        shutil.rmtree(os.path.join(images, '002'))
+        _make_images(images, (52,))
+        shutil.rmtree(os.path.join(images, '026', 'dark'))
+        assert _create(images, dbfile, recreate=False, update=True) == 0
+        updated = _association_counts(dbfile)
+        assert updated[('mc-rgb', 'world', 'train')] == 4
+        assert ('ud-nir', 'dev', 'probe') not in updated
+        assert updated[('ud-nir', 'eval', 'probe')] == 8
+
+        # the update gives the same associations as a new creation
+        recreated = os.path.join(directory, 'db', 'recreated.sql3')
+        assert _create(images, recreated) == 0
+        assert _association_counts(recreated) == updated
+
+        # a database built without manifest is created again by an update
+        os.unlink(recreated + '.manifest.json')
+        assert _create(images, recreated, recreate=False, update=True) == 0
+        assert _association_counts(recreated) == updated
+        assert os.path.exists(recreated + '.manifest.json')
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_check():
+    # Missing files should be found by listing each directory once, and reported per recording
+
+    import tempfile, shutil, io, json, csv
+    from .table import FileRow
+    from .check import find_missing, write_report, verify_files, read_manifest, write_manifest, PNG_TRAILER
+
+    files = [FileRow(k + 1, 1 + k // 4, 'controlled', ('laptop', 'mobile')[k % 2], str(k // 2 % 2), 'rgb', 'frontal',
+        '%03d/controlled/%s/%d/color/%02d' % (1 + k // 4, ('laptop', 'mobile')[k % 2], k // 2 % 2, k)) for k in range(8)]
+    directory = tempfile.mkdtemp(prefix='bob_db_fargo_')
+    try:
+        for f in files[1:6]:
+            path = f.make_path(directory, '.png')
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(b'\x89PNG' + PNG_TRAILER)
+
+        missing = find_missing(files, directory, '.png', workers=3)
+        assert [f.id for f in missing] == [1, 7, 8]
+
+        output = io.StringIO()
+        write_report(output, missing, len(files), directory, '.png', 'json')
+        report = json.loads(output.getvalue())
+        assert (report['files'], report['missing']) == (8, 3)
+        assert [(g['client_id'], g['device'], g['recording'], len(g['missing'])) for g in report['groups']] == \
+            [(1, 'laptop', '0', 1), (2, 'laptop', '1', 1), (2, 'mobile', '1', 1)]
+
+        # all files are hashed once
+        existing = files[1:6]
+        manifest_file = os.path.join(directory, 'checksums.json')
+        manifest, corrupted, hashed = verify_files(existing, directory, '.png', read_manifest(manifest_file), workers=2)
+        assert (corrupted, hashed) == ([], 5)
+        write_manifest(manifest_file, manifest)
+        manifest, corrupted, hashed = verify_files(existing, directory, '.png', read_manifest(manifest_file), workers=2)
+        assert (corrupted, hashed) == ([], 0)
+
+        # only the truncated file is hashed again
+        with open(files[2].make_path(directory, '.png'), 'wb') as f:
+            f.write(b'\x89PNG' + PNG_TRAILER[:-3])
+        manifest, corrupted, hashed = verify_files(existing, directory, '.png', manifest, workers=2)
+        assert (corrupted, hashed) == ([files[2]], 1)
+
+        output = io.StringIO()
+        write_report(output, missing, len(files), directory, '.png', 'csv', corrupted)
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        assert rows[0] == ['client_id', 'light', 'device', 'recording', 'status', 'path']
+        assert rows[1][-2:] == ['missing', files[0].make_path(directory, '.png')]
+        assert rows[2][-2:] == ['corrupted', files[2].make_path(directory, '.png')]
+        assert len(rows) == 5
+    finally:
+        shutil.rmtree(directory)
+
+    # the manifest is never written to the current directory
+    import argparse
+    from .driver import checkfiles
+    args = argparse.Namespace(directory='', extension='.png', verify=True, manifest=None, rehash=False, workers=2,
+        report=None, format='json', selftest=True)
+    try:
+        checkfiles(args)
+        assert False, "--verify requires a directory or a manifest"
+    except ValueError:
+        pass
+
+
+@db_available
+def test_dumplist():
+    # All protocol lists should be dumped at once, filtered and formatted
+
+    import argparse, tempfile, shutil, json
+    from .driver import dumplist
+
+    db = bob.db.fargo.Database()
+    directory = tempfile.mkdtemp(prefix='bob_db_fargo_')
+    try:
+        args = argparse.Namespace(directory='images', extension='.png', protocol=None, all=True, purpose='probe', group='dev',
+            modality=None, model_ids=None, format='jsonl', output_dir=directory, selftest=False)
+        assert dumplist(args) == 0
+        assert len(os.listdir(directory)) == len(db.protocol_names())
+
+        # the concatenated lists of all protocols cannot be told apart
+        args.output_dir, args.format = None, 'lines'
+        try:
+            dumplist(args)
+            assert False, "--all requires an output directory"
+        except ValueError:
+            pass
+        args.output_dir, args.format = directory, 'jsonl'
+        with open(os.path.join(directory, 'ud-rgb2nir.jsonl')) as f:
+            entries = [json.loads(line) for line in f]
+        files = db.objects(protocol='ud-rgb2nir', purposes='probe', groups='dev')
+        assert [e['id'] for e in entries] == [f.id for f in files]
+        assert entries[0]['path'] == files[0].make_path('images', '.png')
+        assert set(e['modality'] for e in entries) == set(['nir'])
+
+        args.all, args.protocol, args.format, args.modality, args.model_ids = False, 'mc-rgb', 'nul', 'rgb', [26, 27]
+        assert dumplist(args) == 0
+        with open(os.path.join(directory, 'mc-rgb.lst')) as f:
+            paths = f.read().split('\0')
+        assert paths[-1] == ''
+        # the probes are filtered by the dumped list only
+        probes = db.objects(protocol='mc-rgb', purposes='probe', groups='dev', model_ids=[26, 27])
+        expected = [f.make_path('images', '.png') for f in probes if f.client_id in (26, 27) and f.modality == 'rgb']
+        assert 0 < len(expected) < len(probes)
+        assert paths[:-1] == expected
+
+        # the modality is filtered in all groups
+        args.protocol, args.modality, args.model_ids = 'mc-rgb2nir', 'rgb', None
+        assert dumplist(args) == 0
+        with open(os.path.join(directory, 'mc-rgb2nir.lst')) as f:
+            paths = f.read().split('\0')[:-1]
+        probes = db.objects(protocol='mc-rgb2nir', purposes='probe', groups='dev')
+        assert probes and set(f.modality for f in probes) == set(['nir'])
+        assert paths == []
+    finally:
+        shutil.rmtree(directory)
+
+
+@db_available
+def test_benchmark():
+    # Every registered query should be measured, cold and warm
+
+    from .benchmark import benchmark_queries, percentile
+
+    assert percentile([3., 1., 2., 4.], 50) == 2.
+    assert percentile([3., 1., 2., 4.], 95) == 4.
+
+    results = benchmark_queries(repeats=2, protocols=['mc-rgb'])
+    queries = results['queries']
+    assert len(queries) == 5 + 2 * 3
+    objects = [q for q in queries if q['method'] == 'objects' and q['groups'] == 'dev' and q['purposes'] == 'probe'][0]
+    assert objects['rows'] == 500
+    for mode in ('cold', 'warm'):
+        assert 0 < objects[mode]['p50'] <= objects[mode]['p95'] <= objects[mode]['max']
+    assert results['peak_rss'] > 0
+
+
+def test_profile_queries():
+    # The profiled statements should be built from the profiled file
+
+    import tempfile, shutil
+    from .benchmark import profile_queries
+
+    directory = tempfile.mkdtemp(prefix='bob_db_fargo_')
+    try:
+        images = os.path.join(directory, 'images')
+        dbfile = os.path.join(directory, 'db.sql3')
+        _make_images(images, (1, 2, 26, 51))
+        _create(images, dbfile)
+
+        counts = _association_counts(dbfile)
+        results = profile_queries(dbfile, repeats=1)
+        assert len(results) == 26 * 5
+        for r in results:
+            assert r['rows'] == counts.get((r['protocol'], r['group'], r['purpose']), 0)
+            assert r['plan']
+    finally:
+        shutil.rmtree(directory)
+
+
+@db_available
+def test_server():
+    # A remote database should answer the queries of the served database
+
+    import tempfile, shutil, threading
+    from .server import QueryServer, RemoteDatabase
+
+    directory = tempfile.mkdtemp(prefix='bob_db_fargo_')
+    path = os.path.join(directory, 'fargo.sock')
+    server = QueryServer(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        db = bob.db.fargo.Database()
+        remote = RemoteDatabase(path)
+        assert remote.protocol_names() == db.protocol_names()
+        assert [c.id for c in remote.clients(groups='dev')] == [c.id for c in db.clients(groups='dev')]
+        assert remote.model_ids(groups='eval') == db.model_ids(groups='eval')
+        assert remote.client(26).group == 'dev'
+        # the clients are fetched without the files
+        assert not remote._rows
+
+        # a running server is never replaced
+        try:
+            QueryServer(path)
+            assert False, "a server is already listening"
+        except RuntimeError:
+            pass
+
+        import numpy
+        files = remote.objects(protocol='ud-rgb2depth', groups='eval', purposes='probe', model_ids=numpy.array([51, 52]))
+        expected = db.objects(protocol='ud-rgb2depth', groups='eval', purposes='probe', model_ids=[51, 52])
+        assert [(f.id, f.path, f.modality) for f in files] == [(f.id, f.path, f.modality) for f in expected]
+        assert len(remote._rows) == len(files)
+        assert len(remote.objects(protocol='mc-rgb', as_table=True)) == len(db.objects(protocol='mc-rgb'))
+
+        try:
+            remote.objects(protocol='unknown')
+            assert False, "the protocol does not exist"
+        except ValueError:
+            pass
+
+        stats = remote.stats()
+        assert stats['methods']['objects']['requests'] == 3
+        # the files of the second query are fetched, those of the first one are known
+        assert stats['methods']['files']['requests'] == 2
+        assert 'table' not in stats['methods']
+        assert stats['methods']['objects']['p50'] <= stats['methods']['objects']['max']
+        remote.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        shutil.rmtree(directory)
+    assert not os.path.exists(path)
@@ -1,6 +1,27 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import os
+
+
+def database_file():
+  """ returns the path to the SQLite file of the database.
+
+  The path is resolved with :py:mod:`importlib.resources`, which is much
+  faster to import than ``pkg_resources``.
+
+  Returns
+  -------
+  str:
+    The path to ``db.sql3``, which may not exist yet.
+  """
+  try:
+    from importlib.resources import files
+  except ImportError: # python < 3.9
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db.sql3')
+  return str(files(__package__).joinpath('db.sql3'))
+
+
 def load_timestamps(filename):
   """ load timestamps of a recording.
   
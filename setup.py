@@ -33,6 +33,7 @@ setup(
         'console_scripts': [
           'bob_db_fargo_extract_images_frontal.py = bob.db.fargo.scripts.extract_images_frontal:main',
           'bob_db_fargo_extract_images_pose_varying.py = bob.db.fargo.scripts.extract_images_pose_varying:main',
+          'bob_db_fargo_benchmark_queries.py = bob.db.fargo.scripts.benchmark_queries:main',
         ],
         
         'bob.db': [